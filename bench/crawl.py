@@ -0,0 +1,474 @@
+#!/usr/bin/python
+
+# Indexing throughput end to end, over a synthetic corpus made from a seed:
+# docx, pptx, odt and pdf files of made up text, and zip and tar.gz archives
+# of them with archives of the other kind nested inside.  Each format's
+# extraction rate is measured on its own first; the corpus is then crawled
+# as a LocalRepo and as a DrupalRepo, the latter from a stand-in Drupal site
+# on localhost which serves the corpus as the attachments of its pages.
+# Every step runs in a fresh process, and every crawl into a fresh index
+# with no cache.  The results, including the peak RSS of each worker, are
+# printed and saved as JSON so that runs can be compared over time.
+
+import argparse
+import BaseHTTPServer
+import email.utils
+import gzip
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import SocketServer
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import tempfile
+import textwrap
+import time
+import urlparse
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SPIDER = os.path.join(ROOT, "spider")
+sys.path.insert(0, SPIDER)
+
+import extract
+
+FORMATS = ["docx", "odt", "pdf", "pptx"]
+MTIME = 1400000000
+CONFIG = """[config]
+cache =
+[local]
+base = %(corpus)s
+baseurl = http://bench.invalid/
+[drupal]
+url = http://127.0.0.1:%(port)u/
+user = bench
+pass = YmVuY2g=
+"""
+
+def words(rng, n = 4096):
+  syllables = [c + v for c in "bcdfghjklmnprstvz" for v in "aeiou"]
+  return ["".join(rng.choice(syllables) for i in range(rng.randint(1, 4)))
+          for j in range(n)]
+
+def text(rng, vocabulary):
+  # paragraphs of 20-80 words, the commonest few words making up much of
+  # the text, roughly as in natural language
+  while True:
+    yield " ".join(vocabulary[int(len(vocabulary) ** rng.random()) - 1]
+                   for i in range(rng.randint(20, 80))).capitalize() + "."
+
+def pdf(path, size, text = None):
+  # 50 lines of Helvetica to a page
+  lines = []
+  n = 0
+  for para in text or itertools.repeat(extract.PARA):
+    if n >= size:
+      break
+    lines += textwrap.wrap(para, 80) + [""]
+    n += len(para)
+  pages = [lines[i:i + 50] for i in range(0, len(lines), 50)]
+
+  objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+             "<< /Type /Pages /Kids [%s] /Count %u >>" %
+             (" ".join("%u 0 R" % (4 + 2 * i) for i in range(len(pages))),
+              len(pages)),
+             "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+  for page in pages:
+    stream = "BT /F1 10 Tf 12 TL 72 750 Td %s ET" % \
+        " ".join("(%s) '" % l.replace("\\", "\\\\").replace("(", "\\(")
+                 .replace(")", "\\)") for l in page)
+    objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %u 0 R >>" %
+                   (len(objects) + 2))
+    objects.append("<< /Length %u >>\nstream\n%s\nendstream" %
+                   (len(stream), stream))
+
+  with open(path, "wb") as f:
+    f.write("%PDF-1.4\n")
+    offsets = []
+    for (i, o) in enumerate(objects):
+      offsets.append(f.tell())
+      f.write("%u 0 obj\n%s\nendobj\n" % (i + 1, o))
+    xref = f.tell()
+    f.write("xref\n0 %u\n0000000000 65535 f \n" % (len(objects) + 1))
+    for o in offsets:
+      f.write("%010u 00000 n \n" % o)
+    f.write("trailer\n<< /Size %u /Root 1 0 R >>\nstartxref\n%u\n%%%%EOF\n" %
+            (len(objects) + 1, xref))
+
+generators = dict(extract.generators, pdf = pdf)
+
+def archive(path, kind, depth, members, document):
+  # a zip or tar.gz of members documents made by document(directory, name),
+  # and below depth 1 an archive of the other kind as well
+  scratch = tempfile.mkdtemp(dir = os.path.dirname(path))
+  try:
+    paths = [document(scratch, "%02u" % i) for i in range(members)]
+    if depth > 1:
+      inner = "tar" if kind == "zip" else "zip"
+      paths.append(os.path.join(scratch, "inner." +
+                                ("zip" if inner == "zip" else "tar.gz")))
+      archive(paths[-1], inner, depth - 1, members, document)
+      os.utime(paths[-1], (MTIME, MTIME))
+
+    if kind == "zip":
+      with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for p in paths:
+          z.write(p, os.path.basename(p))
+    else:
+      # a fixed gzip timestamp, so that the same seed makes the same bytes
+      with gzip.GzipFile(path, "wb", mtime = MTIME) as gz:
+        with tarfile.open(fileobj = gz, mode = "w") as t:
+          for p in paths:
+            t.add(p, os.path.basename(p))
+  finally:
+    shutil.rmtree(scratch)
+
+def corpus(top, args):
+  # count documents of each format in top/<format>/, and archives of as many
+  # documents each, nested depth deep, in top/archives/
+  rng = random.Random(args.seed)
+  vocabulary = words(rng)
+
+  def document(directory, name, fmt = None):
+    fmt = fmt or rng.choice(FORMATS)
+    path = os.path.join(directory, "%s.%s" % (name, fmt))
+    generators[fmt](path, args.size * 1024, text(rng, vocabulary))
+    os.utime(path, (MTIME, MTIME))
+    return path
+
+  for fmt in FORMATS:
+    os.makedirs(os.path.join(top, fmt))
+    for i in range(args.count):
+      document(os.path.join(top, fmt), "%04u" % i, fmt)
+
+  os.makedirs(os.path.join(top, "archives"))
+  for i in range(args.archives):
+    kind = ["zip", "tar"][i % 2]
+    path = os.path.join(top, "archives",
+                        "%04u.%s" % (i, "zip" if kind == "zip" else "tar.gz"))
+    archive(path, kind, args.depth, args.members, document)
+    os.utime(path, (MTIME, MTIME))
+
+def files(top):
+  # (kind, path relative to top) of every file in the corpus
+  for d in sorted(os.listdir(top)):
+    for f in sorted(os.listdir(os.path.join(top, d))):
+      if d == "archives":
+        kind = "zip" if f.endswith(".zip") else "tar"
+      else:
+        kind = d
+      yield (kind, os.path.join(d, f))
+
+
+# The corpus as a Drupal site: a few files attached to each of its pages,
+# which are listed in /admin/content newest first, a page of the listing at
+# a time, much as DrupalRepo finds them on a real site.
+
+PER_NODE = 3
+PER_LISTING = 50
+
+LOGIN = """<html><body><form id="user-login" method="post" action="/user">
+<input type="hidden" name="form_id" value="user_login"/>
+<input type="text" name="name"/><input type="password" name="pass"/>
+</form></body></html>"""
+
+class Site(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, top, seed):
+    BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+    self.top = top
+    self.seed = seed
+    self.vocabulary = words(random.Random(seed))
+    self.files = [f for (kind, f) in files(top)]
+    self.nodes = (len(self.files) + PER_NODE - 1) // PER_NODE
+
+  def url(self, path):
+    return "http://127.0.0.1:%u/%s" % (self.server_port, path.lstrip("/"))
+
+  def mtime(self, node):
+    return MTIME - 60 * node
+
+  def listing(self, page):
+    rows = []
+    for i in range(page * PER_LISTING,
+                   min((page + 1) * PER_LISTING, self.nodes)):
+      rows.append("<tr><td></td><td><a href=\"/node/%u\">Page %u</a></td>"
+                  "<td>Wiki Page</td><td>bench</td><td>published</td>"
+                  "<td>%s</td></tr>" %
+                  (i, i, time.strftime("%Y-%m-%d %H:%M",
+                                       time.gmtime(self.mtime(i)))))
+    pager = ""
+    if (page + 1) * PER_LISTING < self.nodes:
+      pager = "<ul><li class=\"pager-next\"><a href=\"/admin/content?order=Updated&amp;sort=desc&amp;page=%u\">next</a></li></ul>" % \
+          (page + 1)
+    return "<html><body><div class=\"content\"><table><tbody>%s</tbody></table></div>%s</body></html>" % \
+        ("".join(rows), pager)
+
+  def node(self, i):
+    paragraphs = text(random.Random(self.seed * 1000003 + i), self.vocabulary)
+    body = "".join("<p>%s</p>" % next(paragraphs) for j in range(8))
+    links = "".join("<div class=\"field-item even\"><a href=\"%s\">%s</a></div>" %
+                    (self.url("files/" + f), os.path.basename(f))
+                    for f in self.files[i * PER_NODE:(i + 1) * PER_NODE])
+    return "<html><body>" \
+        "<div class=\"field field-name-body field-type-text-with-summary\">%s</div>" \
+        "<div class=\"field field-name-field-file-attachments field-type-file\"><div class=\"field-items\">%s</div></div>" \
+        "</body></html>" % (body, links)
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+    url = urlparse.urlparse(self.path)
+    query = dict(urlparse.parse_qsl(url.query))
+    if url.path == "/user":
+      self.reply(LOGIN)
+    elif url.path == "/admin/content":
+      self.reply(self.server.listing(int(query.get("page", 0))))
+    elif url.path.startswith("/node/"):
+      self.reply(self.server.node(int(url.path[6:])),
+                 self.server.mtime(int(url.path[6:])))
+    elif url.path.startswith("/files/") and url.path[7:] in self.server.files:
+      with open(os.path.join(self.server.top, url.path[7:]), "rb") as f:
+        self.reply(f.read(), MTIME)
+    else:
+      self.send_error(404)
+
+  def do_POST(self):
+    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    self.reply("")
+
+  def reply(self, body, mtime = None):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    if mtime:
+      self.send_header("Last-Modified",
+                       email.utils.formatdate(mtime, usegmt = True))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+def rss(who):
+  # peak RSS in MiB
+  return resource.getrusage(who).ru_maxrss / 1024.0
+
+def child_extract(args):
+  import formats
+
+  results = {}
+  for (kind, f) in files(args.corpus):
+    r = results.setdefault(kind, { "files": 0, "bytes": 0, "chars": 0,
+                                   "seconds": 0.0, "errors": 0 })
+    path = os.path.join(args.corpus, f)
+    t = time.time()
+    try:
+      (_text, members) = formats.extract(path)
+      r["chars"] += len(_text or "")
+      for (filename, p) in members:
+        os.unlink(p)
+    except Exception:
+      r["errors"] += 1
+    r["seconds"] += time.time() - t
+    r["files"] += 1
+    r["bytes"] += os.path.getsize(path)
+
+  for r in results.values():
+    r["mib_per_s"] = r["bytes"] / 1048576.0 / r["seconds"]
+    r["files_per_s"] = r["files"] / r["seconds"]
+  return results
+
+def child_crawl(args, kind):
+  import db
+  import fetcher
+  import formats.sandbox
+  import spider
+  import utils
+  import writer
+  if kind == "drupal":
+    import repos.drupal
+  else:
+    import repos.local
+
+  utils.log.setLevel(logging.WARNING)
+  peaks = multiprocessing.Queue()
+
+  class Peak(object):
+    # reports the peak RSS of the worker, and of any sandbox helper it ran,
+    # as it exits
+    def worker(self):
+      super(Peak, self).worker()
+      # the helper only counts towards RUSAGE_CHILDREN once reaped
+      if formats.sandbox._sandbox:
+        formats.sandbox._sandbox.kill()
+      peaks.put((multiprocessing.current_process().name,
+                 rss(resource.RUSAGE_SELF), rss(resource.RUSAGE_CHILDREN)))
+
+  class Spider(Peak, spider.Spider):
+    pass
+
+  class Writer(Peak, writer.Writer):
+    pass
+
+  class Fetcher(Peak, fetcher.Fetcher):
+    pass
+
+  _db = db.DB(".db")
+  with open(os.path.join(SPIDER, "db-schema.sql")) as f:
+    _db.create(f.read())
+  _db.close()
+
+  if kind == "drupal":
+    repo = repos.drupal.DrupalRepo()
+  else:
+    repo = repos.local.LocalRepo()
+  _writer = None
+  if args.writer or args.fan_out:
+    _writer = Writer()
+  s = Spider(repo, args.workers, _writer, False, args.fan_out)
+  if args.fetchers:
+    s.fetcher = Fetcher(s, args.fetchers, 0)
+
+  t = time.time()
+  s.index()
+  t = time.time() - t
+
+  _db = db.DB(".db")
+  documents = _db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+  _db.checkpoint("RESTART")
+  _db.close()
+
+  # every worker has exited by now
+  workers = {}
+  while not peaks.empty():
+    (name, worker, sandbox) = peaks.get()
+    workers[name] = { "rss_mib": worker, "sandbox_rss_mib": sandbox }
+
+  corpus = sum(os.path.getsize(os.path.join(args.corpus, f))
+               for (k, f) in files(args.corpus))
+  return { "seconds": t, "documents": documents, "docs_per_s": documents / t,
+           "mib_per_s": corpus / 1048576.0 / t,
+           "db_bytes": os.path.getsize(".db"), "workers": workers }
+
+def child(args):
+  site = None
+  if args.child == "drupal":
+    site = Site(args.corpus, args.seed)
+  with open(".config", "w") as f:
+    f.write(CONFIG % { "corpus": args.corpus,
+                       "port": site.server_port if site else 0 })
+
+  if args.child == "extract":
+    result = child_extract(args)
+  else:
+    if site:
+      server = multiprocessing.Process(target = site.serve_forever)
+      server.daemon = True
+      server.start()
+    try:
+      result = child_crawl(args, args.child)
+    finally:
+      if site:
+        server.terminate()
+  print json.dumps(result)
+
+def revision():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd = ROOT,
+                                   stderr = open(os.devnull, "w")).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--seed", type = int, default = 0)
+  ap.add_argument("--count", type = int, default = 25,
+                  help = "documents of each format")
+  ap.add_argument("--size", type = int, default = 64,
+                  help = "KiB of text per document")
+  ap.add_argument("--archives", type = int, default = 10)
+  ap.add_argument("--members", type = int, default = 4,
+                  help = "documents per archive, besides any nested archive")
+  ap.add_argument("--depth", type = int, default = 2,
+                  help = "levels of archives within archives")
+  ap.add_argument("--corpus",
+                  help = "generate the corpus here, or reuse it if present")
+  ap.add_argument("--repos", nargs = "+", choices = ["local", "drupal"],
+                  default = ["local", "drupal"])
+  ap.add_argument("-w", "--workers", type = int, default = 4)
+  ap.add_argument("--writer", action = "store_true")
+  ap.add_argument("--fan-out", action = "store_true")
+  ap.add_argument("-f", "--fetchers", type = int, default = 0)
+  ap.add_argument("-o", "--output",
+                  default = time.strftime("crawl-%Y%m%d-%H%M%S.json"),
+                  help = "where to save the results")
+  ap.add_argument("--child")
+  args = ap.parse_args()
+
+  if args.child:
+    child(args)
+    return
+
+  tmp = tempfile.mkdtemp()
+  try:
+    top = os.path.abspath(args.corpus or os.path.join(tmp, "corpus"))
+    if not os.path.isdir(top):
+      t = time.time()
+      corpus(top, args)
+      print "corpus generated in %.1fs" % (time.time() - t)
+
+    def run(kind):
+      cwd = os.path.join(tmp, kind)
+      os.mkdir(cwd)
+      out = subprocess.check_output([sys.executable, os.path.abspath(__file__)] +
+                                    sys.argv[1:] +
+                                    ["--child", kind, "--corpus", top],
+                                    cwd = cwd)
+      return json.loads(out)
+
+    results = { "time": time.time(), "revision": revision(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "parameters": dict(vars(args), corpus = top),
+                "extract": run("extract"), "crawls": {} }
+    del results["parameters"]["child"]
+
+    print "%-6s %6s %10s %10s %10s %7s" % ("format", "files", "MiB", "MiB/s",
+                                           "files/s", "errors")
+    for (kind, r) in sorted(results["extract"].items()):
+      print "%-6s %6u %10.1f %10.2f %10.1f %7u" % \
+          (kind, r["files"], r["bytes"] / 1048576.0, r["mib_per_s"],
+           r["files_per_s"], r["errors"])
+
+    print
+    print "%-6s %8s %6s %8s %8s %10s  %s" % ("repo", "seconds", "docs",
+                                             "docs/s", "MiB/s", "index MiB",
+                                             "peak RSS MiB")
+    for kind in args.repos:
+      r = results["crawls"][kind] = run(kind)
+      print "%-6s %8.1f %6u %8.1f %8.2f %10.1f  %s" % \
+          (kind, r["seconds"], r["documents"], r["docs_per_s"],
+           r["mib_per_s"], r["db_bytes"] / 1048576.0,
+           " ".join("%s %.0f" % (name, w["rss_mib"])
+                    for (name, w) in sorted(r["workers"].items())))
+
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent = 2, sort_keys = True)
+    print
+    print "saved to %s" % args.output
+  finally:
+    shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+  main()
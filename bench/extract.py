@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+# Text extraction throughput and peak RSS for large docx, pptx and odt files.
+# Each file is read in a fresh process so that peak RSS is its own.
+
+import argparse
+import itertools
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "spider"))
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+A = 'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" ' \
+    'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"'
+O = 'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" ' \
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+
+PARA = "The quick brown fox jumps over the lazy dog. " * 4
+
+def paragraphs(size, fmt, text = None):
+  # fmt filled in with the paragraphs of text (by default PARA, over and
+  # over) until size bytes have been made
+  n = 0
+  for para in text or itertools.repeat(PARA):
+    if n >= size:
+      break
+    p = fmt % para
+    n += len(p)
+    yield p
+
+def docx(path, size, text = None):
+  body = "".join(paragraphs(size, "<w:p><w:r><w:t>%s</w:t></w:r></w:p>",
+                            text))
+  with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+    z.writestr("[Content_Types].xml", "<Types/>")
+    z.writestr("word/document.xml",
+               "<w:document %s><w:body>%s</w:body></w:document>" % (W, body))
+
+def pptx(path, size, text = None, slides = 10):
+  with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+    z.writestr("[Content_Types].xml", "<Types/>")
+    z.writestr("ppt/presentation.xml", "<p:presentation %s/>" % A)
+    for i in range(1, slides + 1):
+      body = "".join(paragraphs(size / slides,
+                                "<a:p><a:r><a:t>%s</a:t></a:r></a:p>", text))
+      z.writestr("ppt/slides/slide%u.xml" % i,
+                 "<p:sld %s><p:cSld><p:spTree>%s</p:spTree></p:cSld></p:sld>" %
+                 (A, body))
+
+def odt(path, size, text = None):
+  body = "".join(paragraphs(size, "<text:p>%s<text:s/></text:p>", text))
+  with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+    z.writestr("mimetype", "application/vnd.oasis.opendocument.text")
+    z.writestr("content.xml",
+               "<office:document-content %s><office:body><office:text>%s</office:text></office:body></office:document-content>" %
+               (O, body))
+
+generators = { "docx": docx, "pptx": pptx, "odt": odt }
+
+def child(path):
+  import formats
+
+  t = time.time()
+  text = formats.read(path)
+  t = time.time() - t
+  print t, len(text), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--size", type = int, default = 64,
+                  help = "MiB of XML per file")
+  ap.add_argument("--repeat", type = int, default = 3)
+  ap.add_argument("--child")
+  args = ap.parse_args()
+
+  if args.child:
+    child(args.child)
+    return
+
+  tmp = tempfile.mkdtemp()
+  try:
+    print "%-6s %10s %10s %12s" % ("format", "MiB/s", "chars/s", "peak RSS MiB")
+    for (fmt, generate) in sorted(generators.items()):
+      path = os.path.join(tmp, "bench." + fmt)
+      generate(path, args.size * 1024 * 1024)
+
+      runs = []
+      for i in range(args.repeat):
+        out = subprocess.check_output([sys.executable, __file__,
+                                       "--child", path])
+        runs.append(map(float, out.split()))
+
+      (t, chars, rss) = min(runs)
+      print "%-6s %10.1f %10.0f %12.1f" % (fmt, args.size / t, chars / t,
+                                           max(r[2] for r in runs) / 1024)
+      os.unlink(path)
+  finally:
+    shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Time taken by the end of crawl sweep to delete stale documents: a synthetic
+# index of n top-level documents with k children each, of which the given
+# fraction are stale, is swept set-wise with writer.delete_trees() and, with
+# --old, as before, by the recursive delete trigger without any indexes.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SPIDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                      "spider")
+sys.path.insert(0, SPIDER)
+
+import db
+import writer
+
+OLD = """
+DROP INDEX documents_repo_indextime;
+DROP INDEX documents_tree_parent;
+DROP INDEX documents_tree_child;
+CREATE TRIGGER t_documents_delete AFTER DELETE ON documents
+BEGIN
+  DELETE FROM documents WHERE rowid IN (SELECT child FROM documents_tree WHERE parent = old.rowid);
+  DELETE FROM documents_fts WHERE docid = old.rowid;
+  DELETE FROM documents_tree WHERE parent = old.rowid OR child = old.rowid;
+END;
+"""
+
+def build(path, n, k, stale, old):
+  _db = db.DB(path)
+  with open(os.path.join(SPIDER, "db-schema.sql")) as f:
+    _db.executescript(f.read())
+  if old:
+    _db.executescript(OLD)
+
+  def documents():
+    id = 0
+    for i in range(n):
+      indextime = 1 if i < n * stale else 2
+      id += 1
+      yield (id, "bench", "d%u" % i, "http://example.com/%u" % i, indextime)
+      for j in range(k):
+        id += 1
+        yield (id, "bench", "d%u-%u" % (i, j), None, indextime)
+
+  def tree():
+    id = 0
+    for i in range(n):
+      top = id = id + 1
+      for j in range(k):
+        id += 1
+        yield (top, id, 1)
+
+  def fts():
+    for id in range(1, n * (k + 1) + 1):
+      yield (id, "document %u" % id)
+
+  _db.executemany("INSERT INTO documents(rowid, repo, name, url, mtime, indextime) VALUES (?, ?, ?, ?, 0, ?)",
+                  documents())
+  _db.executemany("INSERT INTO documents_tree VALUES (?, ?, ?)", tree())
+  _db.executemany("INSERT INTO documents_fts(docid, content) VALUES (?, ?)",
+                  fts())
+  _db.commit()
+  _db.close()
+
+def sweep(path, old):
+  _db = db.DB(path)
+  t = time.time()
+  if old:
+    _db.execute("DELETE FROM documents WHERE repo = ? AND indextime < ?",
+                ["bench", 2])
+  else:
+    writer.delete_trees(_db, "repo = ? AND indextime < ?", ["bench", 2])
+  _db.commit()
+  t = time.time() - t
+
+  left = _db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+  _db.close()
+  return (t, left)
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("-n", type = int, default = 200000,
+                  help = "top-level documents")
+  ap.add_argument("-k", type = int, default = 4,
+                  help = "children per top-level document")
+  ap.add_argument("--stale", type = float, default = 0.5)
+  ap.add_argument("--old", action = "store_true",
+                  help = "also time the trigger-based sweep (slow!)")
+  args = ap.parse_args()
+
+  tmp = tempfile.mkdtemp()
+  try:
+    print "%u documents, %u stale" % (args.n * (args.k + 1),
+                                      int(args.n * args.stale) * (args.k + 1))
+    for old in ([True] if args.old else []) + [False]:
+      path = os.path.join(tmp, "old.db" if old else "new.db")
+      t = time.time()
+      build(path, args.n, args.k, args.stale, old)
+      t = time.time() - t
+      (gc, left) = sweep(path, old)
+      print "%-8s built in %6.1fs, swept in %8.2fs, %u documents left" % \
+          ("trigger" if old else "set", t, gc, left)
+  finally:
+    shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+# Search latency under concurrent load, as the search app sees it: each
+# request counts the matches and fetches the first page, on a connection
+# opened for the request or on one from the pool.  Queries are terms drawn
+# from the index's own vocabulary.
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+SPIDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                      "spider")
+sys.path.insert(0, SPIDER)
+
+import db
+
+def terms(name, n):
+  _db = db.DB(name)
+  if _db.fts == "fts5":
+    _db.execute("CREATE VIRTUAL TABLE temp.vocab USING fts5vocab(main, documents_fts, row)")
+    sql = "SELECT term FROM temp.vocab"
+  else:
+    _db.execute("CREATE VIRTUAL TABLE temp.vocab USING fts4aux(main, documents_fts)")
+    sql = "SELECT term FROM temp.vocab WHERE col = '*'"
+  words = [r[0] for r in _db.execute(sql)]
+  _db.close()
+  random.seed(0)
+  return [random.choice(words) for i in range(n)]
+
+def run(name, queries, threads, pooled):
+  connections = db.Pool(name, 256 * 1024 * 1024, 16 * 1024 * 1024)
+  latencies = []
+  lock = threading.Lock()
+
+  def worker(queries):
+    for q in queries:
+      t = time.time()
+      if pooled:
+        _db = connections.get()
+      else:
+        _db = db.DB(name)
+      _db.count(q)
+      _db.search(q)
+      if not pooled:
+        _db.close()
+      t = time.time() - t
+      with lock:
+        latencies.append(t)
+
+  ts = [threading.Thread(target = worker, args = (queries[i::threads], ))
+        for i in range(threads)]
+  t = time.time()
+  for th in ts:
+    th.start()
+  for th in ts:
+    th.join()
+  t = time.time() - t
+
+  latencies.sort()
+  return (len(latencies) / t, latencies[len(latencies) / 2] * 1000,
+          latencies[len(latencies) * 99 / 100] * 1000)
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("db")
+  ap.add_argument("--requests", type = int, default = 2000)
+  ap.add_argument("--threads", type = int, default = 8)
+  args = ap.parse_args()
+
+  queries = terms(args.db, args.requests)
+  print "%-8s %10s %10s %10s" % ("", "req/s", "p50 ms", "p99 ms")
+  for pooled in [False, True]:
+    print "%-8s %10.1f %10.2f %10.2f" % (("pool" if pooled else "connect", ) +
+                                         run(args.db, queries, args.threads,
+                                             pooled))
+
+if __name__ == "__main__":
+  main()
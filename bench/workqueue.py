@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+# Items per second through a WorkerPool whose workers do nothing but rebuild
+# what they receive: whole Document objects, as the spider used to queue,
+# against the (class, name, url, ...) descriptors it queues now.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "spider"))
+
+import repos.drupal
+import repos.local
+import spider
+import workerpool
+
+
+class Pool(workerpool.WorkerPool):
+  def __init__(self, repo, processcount):
+    super(Pool, self).__init__(processcount, None)
+    self.repo = repo
+
+  def do_work(self, item):
+    if isinstance(item, tuple):
+      item[0].undescribe(self.repo, item)
+
+
+def local_repo():
+  return repos.local.LocalRepo()
+
+def local_doc(repo, i):
+  doc = spider.LocalDocument(repo, "%u.pdf" % i,
+                             "http://example.com/dir/%u.pdf" % i)
+  doc.basepath = "/srv/files/dir/%u.pdf" % i
+  doc._mtime = 1400000000 + i
+  return doc
+
+def drupal_repo():
+  # as DrupalRepo(), but without logging in anywhere
+  repo = repos.drupal.DrupalRepo.__new__(repos.drupal.DrupalRepo)
+  spider.Repo.__init__(repo)
+  repo.conn = repos.drupal.DrupalConnection(repo)
+  return repo
+
+def drupal_doc(repo, i):
+  return repos.drupal.DrupalPage(repo, "Page %u" % i,
+                                 "http://example.com/node/%u" % i,
+                                 "Wiki Page", 1400000000 + i)
+
+repo_types = { "local": (local_repo, local_doc),
+               "drupal": (drupal_repo, drupal_doc) }
+
+def run(repo, docs, processcount, describe):
+  pool = Pool(repo, processcount)
+  pool.start_processes()
+
+  t = time.time()
+  for doc in docs:
+    pool.enqueue(doc.describe() if describe else doc)
+  pool.wait()
+  t = time.time() - t
+
+  pool.stop_processes()
+  return len(docs) / t
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("-n", type = int, default = 100000)
+  ap.add_argument("-w", "--workers", type = int, default = 4)
+  ap.add_argument("--repeat", type = int, default = 3)
+  args = ap.parse_args()
+
+  print "%-8s %14s %14s" % ("repo", "objects/s", "descriptors/s")
+  for (name, (make_repo, make_doc)) in sorted(repo_types.items()):
+    repo = make_repo()
+    docs = [make_doc(repo, i) for i in range(args.n)]
+    rates = [max(run(repo, docs, args.workers, describe)
+                 for i in range(args.repeat))
+             for describe in [False, True]]
+    print "%-8s %14.0f %14.0f" % (name, rates[0], rates[1])
+
+if __name__ == "__main__":
+  main()
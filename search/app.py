@@ -1,47 +1,83 @@
 #!/usr/bin/python
 
+import base64
 import json
 import time
 import urlparse
 import web
 
-from spider import db
+import results
+import suggest
+from spider import shards
 
 class Index(object):
   def GET(self):
     web.header("Content-Type", "text/html")
     return open("static/index.html")
 
+# The cursor handed back with a page of results is where the next page
+# starts (see shards.Federation.search()), along with the total number of
+# matches, counted for the first page only.
+def pack(key, index, id, total):
+  return base64.urlsafe_b64encode(json.dumps([key, index, id, total]))
+
+def unpack(c):
+  try:
+    (key, index, id, total) = json.loads(base64.urlsafe_b64decode(c))
+  except (TypeError, ValueError):
+    raise web.badrequest()
+  return ((key, index, id), total)
+
 class Search(object):
   def GET(self):
     query = dict(urlparse.parse_qsl(str(web.ctx.query[1:])))
-    if "p" not in query: query["p"] = 0
+    web.header("Content-Type", "application/json")
+    return cache.get((query["q"], query.get("c")),
+                       lambda: self.search(query))
+
+  def search(self, query):
+    if "c" in query:
+      (after, total) = unpack(query["c"])
+    else:
+      (after, total) = (None, federation.count(query["q"]))
 
-    cursor = web.ctx.db.execute("SELECT name, url, SNIPPET(documents_fts) AS snippet, mtime FROM documents, documents_fts WHERE documents.rowid = documents_fts.rowid AND content MATCH ? ORDER BY mtime DESC LIMIT ?, 10", [query["q"], str(int(query["p"]) * 10)])
-    fieldnames = [c[0] for c in cursor.description]
-    rows = []
-    for row in cursor:
-      row = dict(zip(fieldnames, row))
+    rows = federation.search(query["q"], after, 11)
+    for row in rows:
       row["mtime"] = time.strftime("%d %B %Y", time.localtime(row["mtime"]))
-      rows.append(row)
 
+    _next = None
+    if len(rows) > 10:
+      rows = rows[:10]
+      _next = pack(rows[-1]["key"], rows[-1]["index"], rows[-1]["id"], total)
+    for row in rows:
+      del row["key"], row["index"], row["id"]
+
+    return json.dumps({ "results": rows, "next": _next, "total": total })
+
+class Suggest(object):
+  def GET(self):
+    query = dict(urlparse.parse_qsl(str(web.ctx.query[1:])))
+    web.header("Content-Type", "application/json")
+    return json.dumps([{ "term": term, "documents": n }
+                       for (term, n) in terms.get(query["q"],
+                                                  int(query.get("n", 10)))])
+
+class Stats(object):
+  def GET(self):
     web.header("Content-Type", "application/json")
-    return json.dumps(rows)
+    return json.dumps(cache.stats())
 
 urls = ("/", "Index",
         "/s", "Search",
+        "/stats", "Stats",
+        "/suggest", "Suggest",
         )
 
-def db_load_hook():
-    web.ctx.db = db.DB("spider/.db")
-
-def db_unload_hook():
-    web.ctx.db.close()
-
 web.config.debug = False
+cache = results.Results("spider", 64 * 1024 * 1024)
+federation = shards.Federation("spider")
+terms = suggest.Terms("spider")
 app = web.application(urls, globals())
-app.add_processor(web.loadhook(db_load_hook))
-app.add_processor(web.unloadhook(db_unload_hook))
 application = app.wsgifunc()
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+import collections
+import threading
+
+from spider import shards
+
+# Responses to recent searches, least recently used first, up to size bytes
+# in all.  Everything is dropped whenever any index under base changes, as
+# SQLite reports through PRAGMA data_version (see shards.Probe).  Each
+# process has its own cache.
+class Results(object):
+  def __init__(self, base, size):
+    self.probe = shards.Probe(base)
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict()
+    self.size = 0
+    self.maxsize = size
+    self.version = None
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, compute):
+    with self.lock:
+      version = self.probe.version()
+      if version != self.version:
+        self.entries.clear()
+        self.size = 0
+        self.version = version
+
+      if key in self.entries:
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+      self.misses += 1
+
+    value = compute()
+
+    with self.lock:
+      # unless the index has changed while computing
+      if version == self.version and key not in self.entries:
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.maxsize:
+          self.size -= len(self.entries.popitem(False)[1])
+
+    return value
+
+  def stats(self):
+    with self.lock:
+      return { "hits": self.hits, "misses": self.misses,
+               "entries": len(self.entries), "size": self.size }
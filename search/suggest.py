@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import array
+import heapq
+import itertools
+import threading
+import time
+
+from spider import db
+from spider import shards
+
+# Completions of a prefix from the vocabularies of the full text indexes
+# under base, most frequent (by number of documents, summed over the indexes)
+# first.  The vocabulary is held as one string of sorted terms with an array
+# of their offsets and one of their document counts, so that a prefix is
+# found by bisection; for the short prefixes which cover too many terms to
+# rank on the fly, the top n are worked out when the vocabulary is loaded.
+#
+# Reading the vocabularies walks every index, so when one changes (see
+# shards.Probe) they are reloaded in the background, and no more often than
+# every interval seconds; until then the old ones are used.
+class Terms(object):
+  def __init__(self, base, n = 10, interval = 60):
+    self.base = base
+    self.n = n
+    self.interval = interval
+    self.probe = shards.Probe(base)
+    self.lock = threading.Lock()
+    self.version = self.probe.version()
+    self.loaded = time.time()
+    self.loading = False
+    self.table = self.load()
+
+  def load(self):
+    terms = []
+    offsets = array.array("I", [0])
+    docs = array.array("I")
+    vocabularies = [self.vocabulary(name) for name in shards.indexes(self.base)]
+    for (term, group) in itertools.groupby(heapq.merge(*vocabularies),
+                                           lambda (term, n): term):
+      terms.append(term)
+      offsets.append(offsets[-1] + len(term))
+      docs.append(sum(n for (term, n) in group))
+
+    table = Table("".join(terms), offsets, docs, {})
+    for length in range(0, 4):
+      for (prefix, i) in itertools.groupby(xrange(len(docs)),
+                                           lambda i: table.term(i)[:length]):
+        i = list(i)
+        if len(prefix) == length and len(i) > 1000:
+          table.top[prefix] = heapq.nlargest(self.n, i, docs.__getitem__)
+    return table
+
+  def vocabulary(self, name):
+    # (term, documents) of one index, in order of term
+    _db = db.DB(name)
+    try:
+      if _db.fts == "fts5":
+        _db.execute("CREATE VIRTUAL TABLE temp.vocab USING fts5vocab(main, documents_fts, row)")
+        sql = "SELECT term, doc FROM temp.vocab ORDER BY term"
+      else:
+        _db.execute("CREATE VIRTUAL TABLE temp.vocab USING fts4aux(main, documents_fts)")
+        sql = "SELECT term, documents FROM temp.vocab WHERE col = '*' ORDER BY term"
+      return _db.execute(sql).fetchall()
+    finally:
+      _db.close()
+
+  def reload(self, version):
+    try:
+      table = self.load()
+    except Exception:
+      version = None
+      raise
+    else:
+      self.table = table
+    finally:
+      with self.lock:
+        self.version = version
+        self.loading = False
+        self.loaded = time.time()
+
+  def get(self, prefix, n):
+    with self.lock:
+      version = self.probe.version()
+      if version != self.version and not self.loading and \
+            time.time() - self.loaded >= self.interval:
+        self.loading = True
+        t = threading.Thread(target = self.reload, args = (version, ))
+        t.daemon = True
+        t.start()
+
+    return self.table.get(prefix.lower(), min(n, self.n))
+
+
+class Table(object):
+  def __init__(self, terms, offsets, docs, top):
+    self.terms = terms
+    self.offsets = offsets
+    self.docs = docs
+    self.top = top
+
+  def term(self, i):
+    return self.terms[self.offsets[i]:self.offsets[i + 1]]
+
+  def bisect(self, s):
+    # index of the first term not less than s
+    (lo, hi) = (0, len(self.docs))
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.term(mid) < s:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def get(self, prefix, n):
+    if prefix in self.top:
+      best = self.top[prefix][:n]
+    else:
+      # no utf-8 encoded text contains \xff
+      best = heapq.nlargest(n, xrange(self.bisect(prefix),
+                                      self.bisect(prefix + "\xff")),
+                            self.docs.__getitem__)
+    return [(self.term(i), self.docs[i]) for i in best]
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import time
+import zlib
+
+from config import config
+import db
+
+schema = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS extracts (hash TEXT PRIMARY KEY, text BLOB, children BLOB NOT NULL, size INTEGER NOT NULL, atime INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS extracts_atime ON extracts(atime);
+CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY, mtime INTEGER NOT NULL, hash TEXT NOT NULL);
+"""
+
+
+# Persistent extraction cache, keyed by the SHA-1 of the file contents.  Each
+# entry holds the compressed text extracted from a file and, for archives, the
+# (name, mtime, hash) listing of its members, each of which has its own entry.
+# sources maps url and mtime to hash so that unchanged files need not even be
+# hashed.
+#
+# Writes, and the access times of the entries read, are held back until
+# commit(), which the spider calls once per document, so that each document
+# costs the cache a single transaction.
+class Cache(object):
+  def __init__(self, name, create = False):
+    self.db = db.DB(name)
+    if create:
+      self.db.executescript(schema)
+    self.extracts = []
+    self.sources = []
+    self.used = set()
+
+  def close(self):
+    self.commit()
+    self.db.close()
+
+  def commit(self):
+    if not (self.extracts or self.sources or self.used):
+      return
+    self.db.executemany("INSERT OR REPLACE INTO extracts VALUES (?, ?, ?, ?, ?)",
+                        self.extracts)
+    self.db.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                        self.sources)
+    self.db.executemany("UPDATE extracts SET atime = ? WHERE hash = ?",
+                        [[int(time.time()), hash] for hash in self.used])
+    self.db.commit()
+    self.extracts = []
+    self.sources = []
+    self.used = set()
+
+  def get(self, hash):
+    # returns (text, [(name, mtime, entry), ...]) or None unless the whole
+    # tree below hash is present
+    r = self.db.execute("SELECT text, children FROM extracts WHERE hash = ?",
+                        [hash]).fetchone()
+    if not r:
+      return None
+
+    children = []
+    for (name, mtime, _hash) in json.loads(zlib.decompress(r[1])):
+      entry = self.get(_hash)
+      if entry is None:
+        return None
+      children.append((name, mtime, entry))
+
+    self.used.add(hash)
+
+    text = r[0]
+    if text is not None:
+      text = zlib.decompress(text).decode("utf-8")
+    return (text, children)
+
+  def put(self, hash, text, children):
+    if text is not None:
+      if isinstance(text, unicode):
+        text = text.encode("utf-8")
+      text = buffer(zlib.compress(text))
+    children = buffer(zlib.compress(json.dumps(children)))
+    size = len(text or "") + len(children)
+
+    self.extracts.append([hash, text, children, size, int(time.time())])
+
+  def source(self, url, mtime):
+    r = self.db.execute("SELECT hash FROM sources WHERE url = ? AND mtime = ?",
+                        [url, mtime]).fetchone()
+    return r and r[0]
+
+  def put_source(self, url, mtime, hash):
+    self.sources.append([url, mtime, hash])
+
+  def evict(self, size):
+    # discard least recently used entries until the cache fits in size bytes
+    self.commit()
+    total = self.db.execute("SELECT TOTAL(size) FROM extracts").fetchone()[0]
+    if total <= size:
+      return
+
+    victims = []
+    for (hash, _size) in self.db.execute("SELECT hash, size FROM extracts ORDER BY atime"):
+      if total <= size:
+        break
+      victims.append([hash])
+      total -= _size
+
+    self.db.executemany("DELETE FROM extracts WHERE hash = ?", victims)
+    self.db.execute("DELETE FROM sources WHERE hash NOT IN (SELECT hash FROM extracts)")
+    self.db.commit()
+
+def digest(path):
+  h = hashlib.sha1()
+  with open(path, "rb") as f:
+    for data in iter(lambda: f.read(65536), ""):
+      h.update(data)
+  return h.hexdigest()
+
+def open_cache(create = False):
+  if not config.get("cache"):
+    return None
+  return Cache(config.get("cache"), create)
+
+def size():
+  return config.getint("cache-size") * 1024 * 1024
@@ -2,13 +2,31 @@
 
 import ConfigParser
 
-defaults = { "errors-fatal": "false" }
+defaults = { "cache": "",
+             "cache-size": "1024",
+             "errors-fatal": "false",
+             "full-sweep-interval": "7",
+             "max-archive-size": "4096",
+             "max-member-size": "1024",
+             "max-pages": "1000",
+             "max-text": "64",
+             "poll-interval": "60",
+             "sandbox": "pdf",
+             "sandbox-memory": "1024",
+             "sandbox-timeout": "60",
+             "shard": "false",
+             "walk-order": "sorted",
+             "walk-threads": "8",
+             "watch-settle": "1" }
 
 class Config:
   def __init__(self, section = "config"):
     self.config = ConfigParser.RawConfigParser(defaults)
     self.config.read(".config")
     self.section = section
+    # a section missing from .config takes every option from defaults
+    if not self.config.has_section(section):
+      self.config.add_section(section)
 
   def get(self, option):
     return self.config.get(self.section, option)
@@ -16,4 +34,7 @@ class Config:
   def getboolean(self, option):
     return self.config.getboolean(self.section, option)
 
+  def getint(self, option):
+    return self.config.getint(self.section, option)
+
 config = Config()
@@ -0,0 +1,7 @@
+DROP TRIGGER t_documents_content_insert;
+DROP TRIGGER t_documents_content_delete;
+DROP TABLE documents_fts;
+CREATE VIRTUAL TABLE documents_fts USING fts4 (content);
+INSERT INTO documents_fts(docid, content) SELECT docid, content FROM documents_content;
+DROP VIEW documents_content;
+DROP TABLE documents_text;
@@ -0,0 +1,17 @@
+CREATE TABLE documents_text (id INTEGER PRIMARY KEY, content BLOB);
+INSERT INTO documents_text SELECT docid, COMPRESS(content) FROM documents_fts;
+DROP TABLE documents_fts;
+CREATE VIEW documents_content AS SELECT id AS docid, UNCOMPRESS(content) AS content FROM documents_text;
+CREATE VIRTUAL TABLE documents_fts USING fts5 (content, content = 'documents_content', content_rowid = 'docid');
+INSERT INTO documents_fts(documents_fts) VALUES ('rebuild');
+INSERT INTO documents_fts(documents_fts) VALUES ('optimize');
+CREATE TRIGGER t_documents_content_insert INSTEAD OF INSERT ON documents_content
+BEGIN
+  INSERT INTO documents_text VALUES (new.docid, COMPRESS(new.content));
+  INSERT INTO documents_fts(rowid, content) VALUES (new.docid, new.content);
+END;
+CREATE TRIGGER t_documents_content_delete INSTEAD OF DELETE ON documents_content
+BEGIN
+  INSERT INTO documents_fts(documents_fts, rowid, content) VALUES ('delete', old.docid, old.content);
+  DELETE FROM documents_text WHERE id = old.docid;
+END;
@@ -1,13 +1,16 @@
 PRAGMA journal_mode = WAL;
+CREATE TABLE schema (version INTEGER NOT NULL);
+INSERT INTO schema VALUES (2);
 CREATE TABLE documents (repo TEXT NOT NULL, name TEXT NOT NULL, url TEXT UNIQUE, mtime INTEGER NOT NULL, indextime INTEGER NOT NULL);
+CREATE INDEX documents_repo_indextime ON documents(repo, indextime);
 CREATE TABLE documents_tree (parent INTEGER NOT NULL, child INTEGER NOT NULL, depth INTEGER NOT NULL);
+CREATE INDEX documents_tree_parent ON documents_tree(parent);
+CREATE INDEX documents_tree_child ON documents_tree(child);
 CREATE VIRTUAL TABLE documents_fts USING fts4 (content);
-CREATE TRIGGER t_documents_delete AFTER DELETE ON documents
-BEGIN
-  DELETE FROM documents WHERE rowid IN (SELECT child FROM documents_tree WHERE parent = old.rowid);
-  DELETE FROM documents_fts WHERE docid = old.rowid;
-  DELETE FROM documents_tree WHERE parent = old.rowid OR child = old.rowid;
-END;
+CREATE TABLE validators (url TEXT PRIMARY KEY, etag TEXT, modified TEXT);
+CREATE TABLE repos (name TEXT PRIMARY KEY, highwater INTEGER NOT NULL, swept INTEGER NOT NULL);
+CREATE TABLE crawls (repo TEXT PRIMARY KEY, starttime INTEGER NOT NULL, since INTEGER, rebuild INTEGER NOT NULL);
+CREATE TABLE failures (hash TEXT PRIMARY KEY, reason TEXT NOT NULL, time INTEGER NOT NULL);
 CREATE TRIGGER t_documents_insert AFTER INSERT ON documents
 BEGIN
   INSERT INTO documents_tree VALUES (new.rowid, new.rowid, 0);
@@ -1,12 +1,50 @@
 #!/usr/bin/python
 
 import argparse
+import glob
 import sqlite3
 import os
+import threading
+import time
+import zlib
+
+import metrics
+import snippet
+
+# Each migrations/<version>-<description>.sql brings the schema from the
+# version before up to <version>; version 0 is the original schema, which
+# had no schema table.  db-schema.sql always creates the latest version.
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "migrations")
+
+def migrations():
+  paths = glob.glob(os.path.join(MIGRATIONS, "*.sql"))
+  return sorted((int(os.path.basename(p).split("-")[0]), p) for p in paths)
+
+def latest():
+  return migrations()[-1][0]
+
+# the fts5 layout keeps the text zlib compressed, as it is only read back to
+# make snippets and to fill the cache
+def compress(text):
+  if text is None:
+    return None
+  if isinstance(text, unicode):
+    text = text.encode("utf-8")
+  return sqlite3.Binary(zlib.compress(text))
+
+def uncompress(data, n = -1):
+  # the first n bytes of the text, or all of it
+  if data is None:
+    return None
+  if n < 0:
+    return zlib.decompress(data)
+  return zlib.decompressobj().decompress(data, n)
 
 class DB(object):
   def __init__(self, name):
     self.name = name
+    self.lockwait = 0
     self.connect()
 
   def checkpoint(self, mode):
@@ -24,55 +62,218 @@ class DB(object):
   def connect(self):
     self.db = sqlite3.connect(self.name)
     self.db.text_factory = str
+    self.db.create_function("COMPRESS", 1, compress)
+    self.db.create_function("UNCOMPRESS", -1, uncompress)
     self.execute("PRAGMA recursive_triggers = 1")
+    self.layout()
+
+  def convert(self, fts):
+    # rebuild the full text index in the given layout, then reclaim the
+    # space the old one took
+    with open("db-%s.sql" % fts) as f:
+      sql = f.read()
+    try:
+      self.executescript("BEGIN;\n%s\nCOMMIT;\n" % sql)
+    except sqlite3.Error:
+      self.rollback()
+      raise
+    self.executescript("VACUUM;")
+    self.layout()
 
   def create(self, sql_script):
     self.close()
     os.unlink(self.name)
     self.connect()
     self.executescript(sql_script)
-    
-  def execute(self, sql, *parameters):
-    while True:
+    self.layout()
+
+  def layout(self):
+    # documents_fts is either an fts4 table holding its own copy of the text,
+    # or an fts5 index over the compressed text in documents_text.  self.text
+    # names the table the text is written to and read from as (docid,
+    # content): documents_fts itself, or the documents_content view.
+    r = self.execute("SELECT sql FROM sqlite_master WHERE name = 'documents_fts'").fetchone()
+    self.fts = "fts5" if r and "USING fts5" in r[0] else "fts4"
+    self.text = "documents_content" if self.fts == "fts5" else "documents_fts"
+
+  def migrate(self):
+    # returns (version before, version after)
+    before = self.version()
+    for (version, path) in migrations():
+      if version <= self.version():
+        continue
+
+      with open(path) as f:
+        sql = f.read()
       try:
-        rv = self.db.execute(sql, *parameters)
-      except sqlite3.OperationalError, e:
-        if e.message == "database is locked":
-          continue
+        self.executescript("BEGIN;\n%s\nCREATE TABLE IF NOT EXISTS schema (version INTEGER NOT NULL);\nDELETE FROM schema;\nINSERT INTO schema VALUES (%u);\nCOMMIT;\n" %
+                           (sql, version))
+      except sqlite3.Error:
+        self.rollback()
         raise
-      return rv
+
+    return (before, self.version())
+
+  def count(self, query):
+    return self.execute("SELECT COUNT(*) FROM documents_fts WHERE documents_fts MATCH ?",
+                        [query]).fetchone()[0]
+
+  def keys(self, query, after = None, limit = 10):
+    # The (id, key) of a page of matches, in the order of key; the next page
+    # is the one after the last of these, found by seeking past it rather
+    # than by counting off every match before it.  fts5 ranks matches by
+    # bm25 (key is the rank), in no defined order among equal ranks, so ties
+    # are broken by rowid; that costs SQLite a sort of its own over the
+    # matches, as fts5 only hands them back in order when ordered by rank
+    # alone.  fts4 has no ranking function, and matches are ordered by
+    # (mtime, rowid) descending instead.  No text is touched.
+    parameters = [query]
+    if self.fts == "fts5":
+      seek = ""
+      if after:
+        seek = " AND (rank > ? OR (rank = ? AND rowid > ?))"
+        parameters += [after[0], after[0], after[1]]
+      sql = "SELECT rowid, rank FROM documents_fts WHERE documents_fts MATCH ?%s ORDER BY rank, rowid LIMIT ?" % seek
+    else:
+      seek = ""
+      if after:
+        seek = " AND (mtime < ? OR (mtime = ? AND documents.rowid < ?))"
+        parameters += [after[0], after[0], after[1]]
+      sql = "SELECT documents.rowid, mtime FROM documents, documents_fts WHERE documents.rowid = documents_fts.rowid AND content MATCH ?%s ORDER BY mtime DESC, documents.rowid DESC LIMIT ?" % seek
+    return self.execute(sql, parameters + [limit]).fetchall()
+
+  def fetch(self, query, keys, snippetbytes = 65536):
+    # the matches picked by keys() as dicts, with snippets made from the
+    # first snippetbytes of their text
+    if not keys:
+      return []
+
+    if self.fts == "fts5":
+      text = "UNCOMPRESS(documents_text.content, ?) FROM documents LEFT JOIN documents_text ON documents_text.id = documents.rowid"
+    else:
+      # SUBSTR() counts characters in text, but bytes in a blob
+      text = "CAST(SUBSTR(CAST(documents_fts.content AS BLOB), 1, ?) AS TEXT) FROM documents LEFT JOIN documents_fts ON documents_fts.docid = documents.rowid"
+    ids = [id for (id, key) in keys]
+    documents = {}
+    for (id, name, url, mtime, content) in self.execute("SELECT documents.rowid, name, url, mtime, %s WHERE documents.rowid IN (%s)" % (text, ", ".join("?" * len(ids))),
+                                                        [snippetbytes] + ids):
+      documents[id] = { "name": name, "url": url, "mtime": mtime,
+                        "snippet": snippet.snippet(content, query, truncated = content is not None and len(content) >= snippetbytes) }
+
+    rows = []
+    for (id, key) in keys:
+      if id in documents:
+        rows.append(dict(documents[id], key = key, id = id))
+    return rows
+
+  def search(self, query, after = None, limit = 10, snippetbytes = 65536):
+    return self.fetch(query, self.keys(query, after, limit), snippetbytes)
+
+  def version(self):
+    try:
+      return self.execute("SELECT version FROM schema").fetchone()[0]
+    except sqlite3.OperationalError, e:
+      if not e.message.startswith("no such table"):
+        raise
+      return 0
+
+  def execute(self, sql, *parameters):
+    return self.retry(self.db.execute, sql, *parameters)
 
   def executemany(self, sql, *parameters):
+    return self.retry(self.db.executemany, sql, *parameters)
+
+  def executescript(self, sql_script):
+    self.db.executescript(sql_script)
+
+  def retry(self, f, *args):
+    # spin while another connection holds the write lock, accounting the time
+    # spent doing so in self.lockwait (and the lock-wait metric)
+    start = None
     while True:
       try:
-        rv = self.db.executemany(sql, *parameters)
+        rv = f(*args)
       except sqlite3.OperationalError, e:
         if e.message == "database is locked":
+          if start is None:
+            start = time.time()
           continue
         raise
+      if start is not None:
+        wait = time.time() - start
+        self.lockwait += wait
+        metrics.add("lock-wait", wait)
       return rv
 
-  def executescript(self, sql_script):
-    self.db.executescript(sql_script)
-
   def rollback(self):
     self.db.rollback()
 
+# One long-lived read-only connection to the index per thread, so that a
+# request neither pays for connecting nor starts with a cold page cache.
+# Pages are read through mmap_size bytes of memory mapping, and up to
+# cache_size bytes of them are cached by each connection.  A connection is
+# replaced when the schema changes underneath it (e.g. after "db.py
+# convert"), as the full text layout it found on connecting may be gone.
+# None of them holds a transaction open between requests, so checkpoints
+# are never held up.
+class Pool(object):
+  def __init__(self, name, mmap_size, cache_size):
+    self.name = name
+    self.mmap_size = mmap_size
+    self.cache_size = cache_size
+    self.local = threading.local()
+
+  def get(self):
+    _db = getattr(self.local, "db", None)
+    if _db is not None and self.schema(_db) != self.local.schema:
+      _db.close()
+      _db = None
+
+    if _db is None:
+      _db = DB(self.name)
+      _db.execute("PRAGMA query_only = 1")
+      _db.execute("PRAGMA mmap_size = %u" % self.mmap_size)
+      _db.execute("PRAGMA cache_size = -%u" % (self.cache_size / 1024))
+      self.local.db = _db
+      self.local.schema = self.schema(_db)
+
+    return _db
+
+  def schema(self, _db):
+    return _db.execute("PRAGMA schema_version").fetchone()[0]
+
 def parse_args():
   ap = argparse.ArgumentParser()
+  ap.add_argument("--shard", metavar = "REPO",
+                  help = "work on the index shard of this repo rather than .db")
   sp = ap.add_subparsers()
   checkpointparser = sp.add_parser("checkpoint")
   checkpointparser.set_defaults(cmd = "checkpoint")
   createparser = sp.add_parser("create")
   createparser.set_defaults(cmd = "create")
+  createparser.add_argument("--fts5", action = "store_true",
+                            help = "index text with fts5 rather than fts4")
+  convertparser = sp.add_parser("convert")
+  convertparser.set_defaults(cmd = "convert")
+  convertparser.add_argument("fts", choices = ["fts4", "fts5"])
+  migrateparser = sp.add_parser("migrate")
+  migrateparser.set_defaults(cmd = "migrate")
   queryparser = sp.add_parser("query")
   queryparser.set_defaults(cmd = "query")
+  queryparser.add_argument("-n", type = int, default = 10,
+                           help = "number of results")
   queryparser.add_argument("querystring")
   return ap.parse_args()
 
 def main():
+  import shards # which imports this module
+
   args = parse_args()
-  db = DB(".db")
+  name = shards.shard(args.shard) if args.shard else ".db"
+  if args.cmd == "create" and args.shard and not os.path.isdir(shards.SHARDS):
+    os.mkdir(shards.SHARDS)
+  if args.cmd != "query":
+    db = DB(name)
 
   if args.cmd == "checkpoint":
     db.checkpoint("RESTART")
@@ -82,10 +283,28 @@ def main():
       sql = f.read()
 
     db.create(sql)
+    if args.fts5:
+      db.convert("fts5")
+
+  elif args.cmd == "convert":
+    if db.fts == args.fts:
+      print "full text index is already %s" % args.fts
+    else:
+      db.convert(args.fts)
+
+  elif args.cmd == "migrate":
+    (before, after) = db.migrate()
+    if before == after:
+      print "schema is up to date at version %u" % after
+    else:
+      print "migrated schema from version %u to %u" % (before, after)
 
   elif args.cmd == "query":
-    for row in db.execute("SELECT DISTINCT url FROM documents, documents_fts WHERE documents.rowid = documents_fts.rowid AND content MATCH ? ORDER BY url", [args.querystring]):
-      print row[0]
+    # every index, unless one is given
+    federation = shards.Federation(names = [name] if args.shard else None)
+    for row in federation.search(args.querystring, limit = args.n):
+      print row["url"] or row["name"]
+      print "  " + " ".join(row["snippet"].split()).encode("utf-8")
 
 if __name__ == "__main__":
   main()
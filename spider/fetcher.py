@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+import multiprocessing
+import requests
+import threading
+import time
+import urlparse
+
+import metrics
+import utils
+import workerpool
+
+
+class RateLimit(object):
+  # at most rate requests per second to any one host; 0 means no limit
+  def __init__(self, rate):
+    self.rate = rate
+    self.lock = threading.Lock()
+    self.next = {}
+
+  def wait(self, url):
+    if not self.rate:
+      return
+
+    host = urlparse.urlparse(url).netloc
+    with self.lock:
+      now = time.time()
+      t = max(now, self.next.get(host, now))
+      self.next[host] = t + 1.0 / self.rate
+
+    if t > now:
+      time.sleep(t - now)
+
+
+# Downloads ahead of the target pool, so that network concurrency is
+# independent of the number of CPU-bound workers: one process runs threads
+# threads sharing a session, which keeps a pool of keep-alive connections per
+# host.  Each item is passed to target.prefetch() and then handed on to the
+# target's queue (or subqueue, for work requeued by its workers); items are
+# counted as outstanding work of the target from the moment they are fetched.
+class Fetcher(workerpool.WorkerPool):
+  processname = "f"
+
+  def __init__(self, target, threads = 16, rate = 0):
+    super(Fetcher, self).__init__(1, 0)
+    self.target = target
+    self.threads = threads
+    self.rate = rate
+    self.slots = multiprocessing.BoundedSemaphore(2 * threads)
+
+  def init_worker(self):
+    self.s = requests.session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize = self.threads,
+                                            pool_block = True)
+    self.s.mount("http://", adapter)
+    self.s.mount("https://", adapter)
+    self.ratelimit = RateLimit(self.rate)
+
+  def fetch(self, item, sub = False):
+    # the main queue is bounded, so the parent blocks here rather than
+    # queueing its whole walk; workers' items must never block
+    with metrics.timed("queue-wait"):
+      if not sub:
+        while not self.slots.acquire(True, 0.1):
+          self.check()
+          self.target.check()
+      self.target.count()
+      self.queue.put((item, sub))
+
+  def do_work(self, item):
+    (item, sub) = item
+    try:
+      item = self.target.prefetch(item, self)
+    except utils.DownloadException:
+      pass
+    except Exception:
+      # pass it on regardless; the worker will retry and deal with the error
+      utils.log.exception("")
+
+    if sub:
+      self.target.subqueue.put(item)
+    else:
+      self.target.queue.put(item)
+      self.slots.release()
+
+  def download(self, url):
+    # returns (path, validators), as utils.download()
+    self.ratelimit.wait(url)
+    return utils.download(url, self.s)
+
+  def thread(self):
+    for item in iter(self.queue.get, None):
+      self.do_work(item)
+      self.publish()
+
+    self.queue.put(None)  # for the next thread
+
+  def worker(self):
+    metrics.reset()
+    self.published = time.time()
+    self.init_worker()
+
+    threads = [threading.Thread(target = self.thread)
+               for i in range(self.threads)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    self.deinit_worker()
+    self.publish(True)
@@ -1,15 +1,11 @@
 #!/usr/bin/python
 
+import importlib
 import tarfile
 import zipfile
 
-import docx
-import html
-import odx
-import pdf
-import pptx
-import tar
-import zip
+import metrics
+import sandbox
 
 # txt, html
 # audio/video: m4v, mov, mp[34], og[agvx]
@@ -17,59 +13,177 @@ import zip
 # spreadsheets(?): ods, xls[mx]?
 # templates(?): ot[pst]
 
-def iter(f, _type = None):
-  if not _type:
-    _type = type(f)
-
-  if _type == "zip":
-    for (filename, path) in zip.iter(f):
-      yield (filename, path)
-  elif _type == "tar":
-    for (filename, path) in tar.iter(f):
-      yield (filename, path)
-
-def read(f, _type = None):
-  if not _type:
-    _type = type(f)
-
-  if _type == "docx":
-    return docx.read(f)
-  elif _type == "pdf":
-    return pdf.read(f)
-  elif _type == "pptx":
-    return pptx.read(f)
-  elif _type in ["odp", "odt"]:
-    return odx.read(f)
-  else:
-    return None
+# Each format is handled by a module with a read(src) function if it has text,
+# and an iter(src) function if it has members, only imported the first time
+# a file of that format is seen.  src is the opened container of the file
+# ("zip" or "tar"), or else its path.
+# Formats are recognised by magic bytes at an offset or, within zip files, by
+# a marker member or the content of the mimetype member.
 
-def type(f):
-  with open(f, "r") as _f:
-    buf = _f.read(4)
-
-  if buf[:4] == "%PDF":
-    return "pdf"
-  elif zipfile.is_zipfile(f):
-    with zipfile.ZipFile(f) as z:
-      if "mimetype" in z.namelist():
-        mimetype = z.read("mimetype")
-        if mimetype == "application/vnd.oasis.opendocument.presentation":
-          return "odp"
-        elif mimetype == "application/vnd.oasis.opendocument.text":
-          return "odt"
-        else:
-          return None
-
-      if "[Content_Types].xml" in z.namelist():
-        if "word/document.xml" in z.namelist():
-          return "docx"
-        elif "ppt/presentation.xml" in z.namelist():
-          return "pptx"
-        else:
-          return None
+formats = {}
+magics = []
+markers = []
+mimetypes = {}
+
+def register(_type, module, container = None, text = True, members = False,
+             magic = None, offset = 0, marker = None, mimetype = None):
+  formats[_type] = (module, container, text, members)
+  if magic:
+    recognise(_type, magic, offset)
+  if marker:
+    markers.append((marker, _type))
+  if mimetype:
+    mimetypes[mimetype] = _type
+
+def recognise(_type, magic, offset = 0):
+  # another magic for a registered format
+  magics.append((offset, magic, _type))
+
+register("pdf", "pdf", magic = "%PDF")
+register("tar", "tar", "tar", False, True, magic = "ustar", offset = 257)
+recognise("tar", "\x1f\x8b")  # tarfile opens gzip and bzip2 compressed
+recognise("tar", "BZh")       # tar files too
+register("zip", "zip", "zip", False, True, magic = "PK\x03\x04")
+register("docx", "docx", "zip", marker = "word/document.xml")
+register("pptx", "pptx", "zip", marker = "ppt/presentation.xml")
+register("odp", "odx", "zip",
+         mimetype = "application/vnd.oasis.opendocument.presentation")
+register("odt", "odx", "zip",
+         mimetype = "application/vnd.oasis.opendocument.text")
+
+SNIFF = max(offset + len(magic) for (offset, magic, _type) in magics)
+
+def accepts(buf):
+  # could a file starting with buf, 512 bytes or all of it, have a type?
+  # Either it has one of the magics above or, like a pre-POSIX tar file,
+  # which has none, it starts with a valid tar header
+  for (offset, magic, _type) in magics:
+    if buf[offset:offset + len(magic)] == magic:
+      return True
+  try:
+    tarfile.TarInfo.frombuf(buf[:512])
+    return True
+  except tarfile.HeaderError:
+    return False
+
+def module(_type):
+  return importlib.import_module("." + formats[_type][0], __name__)
+
+
+# A file opened once to find its type, along with the zip or tar container
+# parsed on the way, which is then handed to the format module as is.
+class Source(object):
+  def __init__(self, path):
+    self.path = path
+    self.type = None
+    self.container = None
+    self.f = open(path, "rb")
+    try:
+      self.sniff()
+    except Exception:
+      self.close()
+      raise
+
+  def sniff(self):
+    buf = self.f.read(SNIFF)
+    for (offset, magic, _type) in magics:
+      if buf[offset:offset + len(magic)] == magic:
+        self.type = _type
+        break
+
+    if self.type in [None, "zip"]:
+      try:
+        self.container = zipfile.ZipFile(self.f)
+        self.type = self.zip_type(self.container)
+        return
+      except zipfile.BadZipfile:
+        pass
+
+    # tarfile also recognises compressed and pre-POSIX tar files
+    if self.type in [None, "tar"]:
+      try:
+        self.f.seek(0)
+        self.container = tarfile.open(fileobj = self.f)
+        self.type = "tar"
+      except tarfile.TarError:
+        self.type = None
+
+  @staticmethod
+  def zip_type(z):
+    names = set(z.namelist())
+    if "mimetype" in names:
+      return mimetypes.get(z.read("mimetype"))
+
+    if "[Content_Types].xml" in names:
+      for (marker, _type) in markers:
+        if marker in names:
+          return _type
+      return None
 
     return "zip"
-  elif tarfile.is_tarfile(f):
-    return "tar"
-  else:
-    return None
+
+  def src(self):
+    if formats[self.type][1]:
+      return self.container
+    return self.path
+
+  def read(self, vet = None):
+    if not self.type or not formats[self.type][2]:
+      return None
+
+    if sandbox.wanted(self.type):
+      if vet and not vet(self.type):
+        return None
+      return sandbox.read(self.type, self.path)
+    return module(self.type).read(self.src())
+
+  def iter(self, budget = None):
+    try:
+      if self.type and formats[self.type][3]:
+        for (filename, path) in module(self.type).iter(self.src(), budget):
+          yield (filename, path)
+    finally:
+      self.close()
+
+  def close(self):
+    if self.container:
+      self.container.close()
+      self.container = None
+    self.f.close()
+
+def extract(f, vet = None, budget = None):
+  # (text, iterator over archive members as (filename, path)) of the file at
+  # f; the file stays open until the iterator is exhausted or discarded.  If
+  # given, vet(type) is asked before a file is read in the sandbox, and the
+  # file is left unread unless it returns True.  Members are charged to
+  # budget (an archive.Budget), or to a budget of their own.
+  with metrics.timed("sniff"):
+    src = Source(f)
+  stage = "extract:%s" % (src.type or "unknown")
+  try:
+    with metrics.timed(stage):
+      text = src.read(vet)
+  except Exception:
+    src.close()
+    raise
+
+  if src.type and formats[src.type][3]:
+    # members are extracted as they are iterated over
+    return (text, metrics.timed_iter(stage, src.iter(budget), 0))
+  src.close()
+  return (text, [])
+
+def iter(f):
+  return Source(f).iter()
+
+def read(f):
+  src = Source(f)
+  try:
+    return src.read()
+  finally:
+    src.close()
+
+def type(f):
+  src = Source(f)
+  src.close()
+  return src.type
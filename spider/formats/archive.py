@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+import logging
+import os
+import tempfile
+
+from config import config
+import formats
+
+SNIFF = 512  # a tar header
+CHUNK = 65536
+
+
+# Bounds on what may be extracted from one archive: each member may be at most
+# max-member-size MiB and all members together at most max-archive-size MiB.
+# Archives nested inside it draw on the same budget, so max-archive-size
+# bounds the whole tree however deep it goes.  Members handed to other
+# processes (see Spider.fan()) each take a share of what is left instead.
+class Budget(object):
+  def __init__(self):
+    self.member = config.getint("max-member-size") * 1024 * 1024
+    self.remaining = config.getint("max-archive-size") * 1024 * 1024
+
+  def share(self, n):
+    # a budget for one of n members, to draw on in another process
+    budget = Budget()
+    budget.remaining = self.remaining / n
+    return budget
+
+  def limit(self):
+    return min(self.member, self.remaining)
+
+  def extract(self, name, src, size, mtime):
+    # stream src to a temporary file piecewise, returning its path, or None if
+    # the member is too large or of a type not worth writing out
+    if size > self.limit():
+      logging.warning("skipping %s: %u bytes" % (name, size))
+      return None
+
+    buf = src.read(SNIFF)
+    if not formats.accepts(buf):
+      return None
+
+    (fd, path) = tempfile.mkstemp()
+    written = 0
+    with os.fdopen(fd, "w") as f:
+      while buf:
+        written += len(buf)
+        if written > self.limit():
+          break
+        f.write(buf)
+        buf = src.read(CHUNK)
+
+    if written > self.limit():
+      logging.warning("skipping %s: more than %u bytes" % (name, self.limit()))
+      os.unlink(path)
+      return None
+
+    self.remaining -= written
+    os.utime(path, (mtime, mtime))
+    return path
@@ -2,12 +2,22 @@
 
 # requires minimum pypoppler-0.12.1-22
 
+import logging
 import poppler
 
-def read(f):
+from config import config
+
+def pages(f):
   doc = poppler.document_new_from_file("file://" + f, None)
-  pages = []
-  for i in range(doc.get_n_pages()):
+  n = doc.get_n_pages()
+  if n > config.getint("max-pages"):
+    logging.warning("%s: reading %u of %u pages" %
+                    (f, config.getint("max-pages"), n))
+    n = config.getint("max-pages")
+
+  for i in range(n):
     page = doc.get_page(i)
-    pages.append(unicode(page.get_text()))
-  return "".join(pages)
+    yield unicode(page.get_text())
+
+def read(f):
+  return "".join(pages(f))
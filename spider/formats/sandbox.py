@@ -0,0 +1,183 @@
+#!/usr/bin/python
+
+import errno
+import json
+import logging
+import os
+import resource
+import select
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from config import config
+
+# Formats listed in the sandbox option (or all of them, given "all") are read
+# by a helper process rather than in the worker, so that a file which hangs
+# or crashes the reader, or runs it out of memory, only costs the helper.
+# Each worker keeps one helper, started on first use and again after it is
+# killed.  Every job is allowed sandbox-timeout seconds, and the helper's
+# address space is capped at sandbox-memory MiB.  The text of a file is cut
+# short at max-text MiB, so that neither the helper nor the worker ever
+# holds more than that.
+#
+# The helper reads one JSON request [type, path] per line and answers with
+# frames of a one byte tag, a four byte length and that many bytes: "p" for
+# each page of text as it is read (or the whole text, for formats without
+# pages), then "d" when done or "e" with an error message.
+
+
+class Error(Exception):
+  # the reader failed in the ordinary way, e.g. on a corrupt file
+  pass
+
+
+class Killed(Exception):
+  # the reader timed out, ran out of memory or crashed
+  pass
+
+
+def wanted(_type):
+  formats = config.get("sandbox").split()
+  return "all" in formats or _type in formats
+
+def read(_type, path):
+  global _sandbox
+  if _sandbox is None:
+    _sandbox = Sandbox()
+  return _sandbox.read(_type, path)
+
+_sandbox = None
+
+
+class Sandbox(object):
+  def __init__(self):
+    self.timeout = config.getint("sandbox-timeout")
+    self.memory = config.getint("sandbox-memory") * 1024 * 1024
+    self.p = None
+
+  def start(self):
+    def limit():
+      resource.setrlimit(resource.RLIMIT_AS, (self.memory, self.memory))
+
+    spider = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    self.p = subprocess.Popen([sys.executable, "-c",
+                               "import sys; sys.path.insert(0, %r); "
+                               "import formats.sandbox; "
+                               "formats.sandbox.serve()" % spider],
+                              stdin = subprocess.PIPE,
+                              stdout = subprocess.PIPE,
+                              preexec_fn = limit, close_fds = True)
+
+  def kill(self):
+    if self.p is None:
+      return
+    try:
+      self.p.kill()
+    except OSError:
+      pass
+    self.p.wait()
+    self.p = None
+
+  def read(self, _type, path):
+    if self.p is None:
+      self.start()
+
+    self.deadline = time.time() + self.timeout
+    try:
+      self.p.stdin.write(json.dumps([_type, path]) + "\n")
+      self.p.stdin.flush()
+
+      pages = []
+      while True:
+        (tag, length) = struct.unpack("!cI", self.recv(5))
+        data = self.recv(length).decode("utf-8", "replace")
+        if tag == "p":
+          pages.append(data)
+        elif tag == "d":
+          return "".join(pages)
+        elif data == "MemoryError":
+          raise Killed("out of memory")
+        else:
+          raise Error(data)
+
+    except Killed:
+      self.kill()
+      raise
+    except IOError as e:
+      if e.errno != errno.EPIPE:
+        raise
+      self.kill()
+      raise Killed("helper died")
+
+  def recv(self, n):
+    buf = []
+    while n:
+      timeout = self.deadline - time.time()
+      if timeout <= 0 or not select.select([self.p.stdout], [], [], timeout)[0]:
+        raise Killed("timed out after %us" % self.timeout)
+
+      data = os.read(self.p.stdout.fileno(), n)
+      if not data:
+        status = self.p.wait()
+        self.p = None
+        if status < 0:
+          raise Killed("helper killed by signal %u" % -status)
+        raise Killed("helper exited with status %u" % status)
+
+      buf.append(data)
+      n -= len(data)
+
+    return "".join(buf)
+
+
+def send(out, tag, data):
+  if isinstance(data, unicode):
+    data = data.encode("utf-8")
+  out.write(struct.pack("!cI", tag, len(data)) + data)
+  out.flush()
+
+def serve():
+  import formats
+
+  # keep the answers to ourselves: anything else writing to stdout, such as
+  # a chatty library, goes to stderr instead
+  out = os.fdopen(os.dup(1), "wb")
+  os.dup2(2, 1)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  limit = config.getint("max-text") * 1024 * 1024
+
+  for line in iter(sys.stdin.readline, ""):
+    (_type, path) = json.loads(line)
+    try:
+      src = formats.Source(path)
+      try:
+        m = formats.module(_type)
+        if hasattr(m, "pages"):
+          pages = m.pages(src.src())
+        else:
+          pages = [m.read(src.src()) or ""]
+
+        # each page is sent as soon as it is read, until there is enough
+        size = 0
+        for page in pages:
+          if isinstance(page, unicode):
+            page = page.encode("utf-8")
+          if size + len(page) > limit:
+            logging.warning("%s: text cut short at %u MiB" %
+                            (path, limit / 1024 / 1024))
+            send(out, "p", page[:limit - size])
+            break
+          send(out, "p", page)
+          size += len(page)
+      finally:
+        src.close()
+      send(out, "d", "")
+
+    except MemoryError:
+      send(out, "e", "MemoryError")
+    except Exception as e:
+      logging.exception("")
+      send(out, "e", "%s: %s" % (e.__class__.__name__, e))
@@ -1,17 +1,13 @@
 #!/usr/bin/python
 
-import calendar
-import os
-import tarfile
-import tempfile
+import archive
 
-def iter(f):
-  with tarfile.open(f) as t:
-    for ti in t.getmembers():
-      if not ti.isfile():
-        continue
-      (fd, path) = tempfile.mkstemp()
-      with os.fdopen(fd, "w") as f:  # TODO: do this piecewise
-        f.write(t.extractfile(ti).read())
-      os.utime(path, (ti.mtime, ti.mtime))
+def iter(t, budget = None):
+  if budget is None:
+    budget = archive.Budget()
+  for ti in t:
+    if not ti.isfile():
+      continue
+    path = budget.extract(ti.name, t.extractfile(ti), ti.size, ti.mtime)
+    if path:
       yield (ti.name, path)
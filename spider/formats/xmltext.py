@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+import lxml.etree
+
+# Text of the first top element of the XML document read from f, produced
+# incrementally with iterparse so that the document is never held in memory
+# as a whole.  The output is that of a depth first walk emitting, for each
+# element, before[tag] if any, its text, its children, its tail and then a
+# newline if tag is in after; elements in skip are dropped along with their
+# tails.  Tags are given as "prefix:name" and resolved using the namespaces
+# declared on the root element.
+#
+# Text and tails are only complete once the parser has moved past them, so
+# an element's text is emitted when its first child starts (or when it ends)
+# and its tail at the next event after it ends, at which point the element
+# is finished with and is cleared.
+
+def read(f, top, skip = [], before = {}, after = []):
+  text = []
+  emit = text.append
+  stack = []         # [element, text emitted] from top downwards
+  pending = None     # element ended, tail not yet emitted
+  skipping = 0
+  done = False
+  tags = None
+
+  for (event, e) in lxml.etree.iterparse(f, events = ("start", "end")):
+    if tags is None:
+      (top, skip, before, after) = resolve(e.nsmap, top, skip, before, after)
+      tags = True
+
+    if skipping:
+      skipping += 1 if event == "start" else -1
+      if not skipping:
+        forget(e)
+      continue
+
+    if pending is not None:
+      if pending.tail:
+        emit(pending.tail)
+      if pending.tag in after:
+        emit("\n")
+      forget(pending)
+      pending = None
+      if not stack:
+        done = True
+
+    if not stack:
+      if event == "start" and e.tag == top and not done:
+        stack.append([e, False])
+        if e.tag in before:
+          emit(before[e.tag])
+      elif event == "end":
+        forget(e)
+      continue
+
+    if event == "start":
+      parent = stack[-1]
+      if not parent[1]:
+        if parent[0].text:
+          emit(parent[0].text)
+        parent[1] = True
+
+      if e.tag in skip:
+        skipping = 1
+        continue
+
+      stack.append([e, False])
+      if e.tag in before:
+        emit(before[e.tag])
+
+    else:
+      if not stack.pop()[1] and e.text:
+        emit(e.text)
+      pending = e
+
+  if pending is not None:
+    if pending.tail:
+      emit(pending.tail)
+    if pending.tag in after:
+      emit("\n")
+
+  return "".join(text)
+
+def resolve(nsmap, top, skip, before, after):
+  def tag(t):
+    (prefix, name) = t.split(":")
+    return "{%s}%s" % (nsmap.get(prefix), name)
+
+  return (tag(top), set(map(tag, skip)),
+          dict((tag(t), s) for (t, s) in before.items()), set(map(tag, after)))
+
+def forget(e):
+  # drop e and anything before it, which has all been emitted already
+  e.clear()
+  parent = e.getparent()
+  if parent is not None:
+    del parent[:parent.index(e)]
@@ -1,16 +1,15 @@
 #!/usr/bin/python
 
 import calendar
-import os
-import tempfile
-import zipfile
 
-def iter(f):
-  with zipfile.ZipFile(f) as z:
-    for zi in z.infolist():
-      (fd, path) = tempfile.mkstemp()
-      with os.fdopen(fd, "w") as f:  # TODO: do this piecewise
-        f.write(z.read(zi))
-      mtime = calendar.timegm(zi.date_time)
-      os.utime(path, (mtime, mtime))
+import archive
+
+def iter(z, budget = None):
+  if budget is None:
+    budget = archive.Budget()
+  for zi in z.infolist():
+    mtime = calendar.timegm(zi.date_time)
+    with z.open(zi) as m:
+      path = budget.extract(zi.filename, m, zi.file_size, mtime)
+    if path:
       yield (zi.filename, path)
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_CHANGED = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+IN_GONE = IN_MOVED_FROM | IN_DELETE
+
+
+# Minimal ctypes binding to the Linux inotify API.
+class Inotify(object):
+  def __init__(self):
+    self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+    self.fd = self.libc.inotify_init()
+    if self.fd < 0:
+      self.error("inotify_init")
+    self.watches = {}
+
+  def error(self, what):
+    e = ctypes.get_errno()
+    raise OSError(e, os.strerror(e), what)
+
+  def add(self, path, mask):
+    wd = self.libc.inotify_add_watch(self.fd, path, mask)
+    if wd < 0:
+      self.error(path)
+    self.watches[wd] = path
+
+  def close(self):
+    os.close(self.fd)
+
+  def read(self, timeout = None):
+    # returns [(mask, path), ...], or [] if nothing happened within timeout;
+    # path is None if the kernel's queue overflowed
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    buf = os.read(self.fd, 65536)
+    events = []
+    i = 0
+    while i < len(buf):
+      (wd, mask, cookie, length) = struct.unpack_from("iIII", buf, i)
+      name = buf[i + 16:i + 16 + length].rstrip("\0")
+      i += 16 + length
+
+      if mask & IN_IGNORED:
+        self.watches.pop(wd, None)
+      elif mask & IN_Q_OVERFLOW:
+        events.append((mask, None))
+      elif wd in self.watches:
+        events.append((mask, os.path.join(self.watches[wd], name)))
+
+    return events
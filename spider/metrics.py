@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import contextlib
+import threading
+import time
+
+# Time spent in each stage of a crawl by this process, and how many times
+# each was entered, along with the bytes it handled where that means
+# anything (e.g. downloads).  The stages are
+#
+#   walk            listing the repo (parent)
+#   download        fetching a remote document
+#   sniff           finding a file's format
+#   extract:<type>  reading the text, or archive members, of that format
+#   index           applying a write to the index
+#   commit          committing the index
+#   documents       documents written to the index, whether read, restored
+#                   from the cache or kept after a 304 (counted, not timed)
+#   lock-wait       waiting for another connection's write lock
+#   queue-wait      waiting to hand work on to a full queue
+#   idle            a worker waiting for work
+#
+# Each worker pool process starts from nothing and sends what it has to its
+# parent now and again and when it exits (see WorkerPool.publish()); the
+# parent sums them.  A snapshot is {stage: [count, seconds, bytes]}.
+
+stages = {}
+lock = threading.Lock()
+
+def reset():
+  # in a new worker: whatever was inherited from the parent is dropped,
+  # along with the lock, which may have been held at the fork
+  global stages, lock
+  stages = {}
+  lock = threading.Lock()
+
+def add(stage, seconds, n = 1, size = 0):
+  with lock:
+    s = stages.setdefault(stage, [0, 0.0, 0])
+    s[0] += n
+    s[1] += seconds
+    s[2] += size
+
+@contextlib.contextmanager
+def timed(stage):
+  t = time.time()
+  try:
+    yield
+  finally:
+    add(stage, time.time() - t)
+
+def timed_iter(stage, iterable, n = 1):
+  # iterable, with the time taken to produce each item added to stage
+  it = iter(iterable)
+  while True:
+    t = time.time()
+    try:
+      item = next(it)
+    except StopIteration:
+      add(stage, time.time() - t, 0)
+      return
+    add(stage, time.time() - t, n)
+    yield item
+
+def snapshot():
+  with lock:
+    return dict((stage, list(s)) for (stage, s) in stages.items())
+
+def merge(snapshots):
+  total = {}
+  for snapshot in snapshots:
+    for (stage, s) in snapshot.items():
+      t = total.setdefault(stage, [0, 0.0, 0])
+      for i in range(3):
+        t[i] += s[i]
+  return total
+
+def documents(snapshot):
+  # documents indexed so far
+  return snapshot.get("documents", [0])[0]
+
+def table(snapshot):
+  lines = ["%-16s %8s %10s %10s %10s" % ("stage", "count", "seconds",
+                                          "ms each", "MiB")]
+  for (stage, (n, seconds, size)) in sorted(snapshot.items()):
+    lines.append("%-16s %8u %10.2f %10.2f %10s" %
+                 (stage, n, seconds, seconds * 1000 / n if n else 0,
+                  "%.1f" % (size / 1048576.0) if size else ""))
+  return lines
+
+def export(snapshot):
+  # as JSON would have it
+  return dict((stage, { "count": n, "seconds": seconds, "bytes": size })
+              for (stage, (n, seconds, size)) in snapshot.items())
@@ -0,0 +1,6 @@
+-- tables added since the original schema, some of which an index created
+-- in the meantime may have already
+CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, etag TEXT, modified TEXT);
+CREATE TABLE IF NOT EXISTS repos (name TEXT PRIMARY KEY, highwater INTEGER NOT NULL, swept INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS crawls (repo TEXT PRIMARY KEY, starttime INTEGER NOT NULL, since INTEGER, rebuild INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS failures (hash TEXT PRIMARY KEY, reason TEXT NOT NULL, time INTEGER NOT NULL);
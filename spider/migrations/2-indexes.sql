@@ -0,0 +1,6 @@
+-- subtrees are now deleted set-wise by writer.delete_trees() rather than
+-- one row at a time by a recursive trigger
+CREATE INDEX IF NOT EXISTS documents_repo_indextime ON documents(repo, indextime);
+CREATE INDEX IF NOT EXISTS documents_tree_parent ON documents_tree(parent);
+CREATE INDEX IF NOT EXISTS documents_tree_child ON documents_tree(child);
+DROP TRIGGER IF EXISTS t_documents_delete;
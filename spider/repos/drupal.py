@@ -6,7 +6,7 @@ import requests
 import urlparse
 import weakref
 
-import formats
+import formats.html
 import spider
 import utils
 
@@ -42,7 +42,7 @@ class DrupalConnection(object):
 class DrupalRepo(spider.Repo):
   def __init__(self):
     super(DrupalRepo, self).__init__()
-    self.conn = DrupalConnection(repo)
+    self.conn = DrupalConnection(self)
     self.conn.login(self.config.get("user"),
                     self.config.get("pass").decode("base64"))
 
@@ -52,23 +52,42 @@ class DrupalRepo(spider.Repo):
   def deinit_worker(self):
     del spider.ctx.s
 
+  def listing(self, href):
+    # one page of /admin/content: (pages, href of the next page or None)
+    response = self.conn.request("GET", href)
+    html = lxml.html.fromstring(response.text)
+
+    pages = []
+    for row in html.xpath("//div[@class = 'content']//tbody//tr"):
+      _name = row[1][0].text
+      _href = row[1][0].get("href")
+      _url = self.conn.url(_href)
+      _type = row[2].text
+      _mtime = utils.parsetime(row[5].text, "%Y-%m-%d %H:%M")
+      pages.append(DrupalPage(self, _name, _url, _type, _mtime))
+
+    href = html.xpath("//li[@class = 'pager-next']/a/@href")
+    return (pages, href and href[0] or None)
+
   def walk(self):
-    href = "/admin/content"
-    while href:
-      response = self.conn.request("GET", href)
-      html = lxml.html.fromstring(response.text)
-
-      for row in html.xpath("//div[@class = 'content']//tbody//tr"):
-        _name = row[1][0].text
-        _href = row[1][0].get("href")
-        _url = self.conn.url(_href)
-        _type = row[2].text
-        _mtime = utils.parsetime(row[5].text, "%Y-%m-%d %H:%M")
-        yield DrupalPage(self, _name, _url, _type, _mtime)
-      
-      href = html.xpath("//li[@class = 'pager-next']/a/@href")
-      if href:
-        href = href[0]
+    # the listing is newest first, so an incremental walk can stop at the
+    # first page older than self.since; the next listing page is fetched in
+    # the background while the current one is being yielded
+    (pages, href) = self.listing("/admin/content?order=Updated&sort=desc")
+    while True:
+      done = self.since and pages and pages[-1].mtime() < self.since
+      if href and not done:
+        next_listing = utils.background(self.listing, href)
+
+      for page in pages:
+        if self.since and page.mtime() < self.since:
+          self.complete = False
+          return
+        yield page
+
+      if not href or done:
+        return
+      (pages, href) = next_listing()
 
 
 class DrupalPage(spider.RemoteDocument):
@@ -80,6 +99,13 @@ class DrupalPage(spider.RemoteDocument):
   def mtime(self):
     return self._mtime
 
+  def describe(self, unlink = False):
+    return super(DrupalPage, self).describe(unlink) + (self.type, )
+
+  @classmethod
+  def create(cls, repo, desc, ancestors):
+    return cls(repo, desc[1], desc[2], desc[8], desc[5])
+
   def read(self):
     html = lxml.html.parse(self.basepath)
 
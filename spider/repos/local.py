@@ -1,25 +1,212 @@
 #!/usr/bin/python
 
+import multiprocessing.pool
 import os
+import Queue
+import stat
+import time
 import urlparse
 
+try:
+  from scandir import scandir
+except ImportError:
+  scandir = None
+
+import inotify
 import spider
+import utils
 
 class LocalRepo(spider.Repo):
-  def walk(self):
-    base = self.config.get("base")
+  def walk(self, top = None):
+    # directories are listed by a pool of threads, which matters on high
+    # latency filesystems; walk-order is either "sorted", the order of a
+    # sorted os.walk(), or "unordered", whichever directory is listed first
+    threads = self.config.getint("walk-threads")
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+      if self.config.get("walk-order") == "unordered":
+        walk = self.walk_unordered(pool, top or self.config.get("base"))
+      else:
+        walk = self.walk_sorted(pool, top or self.config.get("base"), {},
+                                4 * threads)
+      for (p, mtime) in walk:
+        yield self.document(p, mtime)
+    finally:
+      pool.terminate()
+
+  def walk_sorted(self, pool, dirpath, pending, ahead):
+    if dirpath not in pending:
+      pending[dirpath] = pool.apply_async(scan, [dirpath])
+    (dirnames, files) = pending.pop(dirpath).get()
+
+    # list the directories coming up next ahead of time, within reason
+    for d in dirnames:
+      if len(pending) >= ahead:
+        break
+      if d not in pending:
+        pending[d] = pool.apply_async(scan, [d])
+
+    for f in files:
+      yield f
 
-    for dirpath, dirnames, filenames in os.walk(base):
-      dirnames[:] = sorted(dirnames)
+    for d in dirnames:
+      for f in self.walk_sorted(pool, d, pending, ahead):
+        yield f
 
-      for f in sorted(filenames):
-        p = os.path.join(dirpath, f)
-        url = self.map(os.path.relpath(p, base))
+  def walk_unordered(self, pool, top):
+    results = Queue.Queue()
+    pool.apply_async(scan, [top], callback = results.put)
+    outstanding = 1
 
-        doc = spider.LocalDocument(self, f, url)
-        doc.basepath = p
+    while outstanding:
+      (dirnames, files) = results.get()
+      outstanding -= 1
+      for d in dirnames:
+        pool.apply_async(scan, [d], callback = results.put)
+        outstanding += 1
 
-        yield doc
+      for f in files:
+        yield f
+
+  def document(self, p, mtime = None):
+    doc = spider.LocalDocument(self, os.path.basename(p), self.url(p))
+    doc.basepath = p
+    doc._mtime = mtime
+    return doc
+
+  def url(self, p):
+    return self.map(os.path.relpath(p, self.config.get("base")))
 
   def map(self, p):
     return urlparse.urljoin(self.config.get("baseurl"), p)
+
+  def watcher(self):
+    try:
+      return InotifyWatcher(self)
+    except (AttributeError, OSError):
+      utils.log.exception("inotify unavailable, polling instead")
+      return PollingWatcher(self)
+
+
+def scan(path):
+  # ([subdirectories], [(file, mtime), ...]) in path, sorted, with the mtimes
+  # coming from scandir() where it is available.  Like os.walk(), errors are
+  # ignored and symlinks to directories are not followed.
+  dirnames = []
+  files = []
+  try:
+    if scandir:
+      entries = ((e.path, e) for e in scandir(path))
+    else:
+      entries = ((os.path.join(path, f), None) for f in os.listdir(path))
+
+    for (p, e) in entries:
+      try:
+        if e:
+          isdir = e.is_dir()
+          islink = e.is_symlink()
+          st = None if isdir else e.stat()
+        else:
+          st = os.stat(p)
+          isdir = stat.S_ISDIR(st.st_mode)
+          islink = os.path.islink(p)
+      except OSError:
+        continue
+
+      if not isdir:
+        files.append((p, int(st.st_mtime)))
+      elif not islink:
+        dirnames.append(p)
+
+  except OSError:
+    pass
+
+  return (sorted(dirnames), sorted(files))
+
+
+# Watchers are set up before the initial crawl so that nothing changing during
+# it is missed, and then iterate over batches of changes: (documents to index,
+# urls removed), where a url ending in / stands for a whole directory.
+
+class InotifyWatcher(object):
+  mask = inotify.IN_CHANGED | inotify.IN_GONE
+
+  def __init__(self, repo):
+    self.repo = repo
+    self.base = repo.config.get("base")
+    self.settle = repo.config.getint("watch-settle")
+    self.inotify = inotify.Inotify()
+    self.add(self.base)
+
+  def add(self, top):
+    for dirpath, dirnames, filenames in os.walk(top):
+      self.inotify.add(dirpath, self.mask)
+
+  def __iter__(self):
+    while True:
+      events = self.inotify.read()
+      # let bursts of events, e.g. from a file being written, settle first
+      while True:
+        more = self.inotify.read(self.settle)
+        if not more:
+          break
+        events.extend(more)
+
+      yield self.batch(events)
+
+  def batch(self, events):
+    changed = set()
+    gone = {}
+    for (mask, p) in events:
+      if p is None:
+        utils.log.warning("inotify queue overflowed, rescanning %s" %
+                          self.base)
+        changed.add(self.base)
+      elif mask & inotify.IN_CHANGED:
+        if mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+          self.add(p)
+        changed.add(p)
+        gone.pop(p, None)
+      elif mask & inotify.IN_GONE:
+        changed.discard(p)
+        gone[p] = mask & inotify.IN_ISDIR
+
+    return (self.documents(changed),
+            [self.repo.url(p) + ("/" if gone[p] else "") for p in sorted(gone)])
+
+  def documents(self, paths):
+    for p in sorted(paths):
+      if os.path.isdir(p):
+        for doc in self.repo.walk(p):
+          yield doc
+      elif os.path.isfile(p):
+        yield self.repo.document(p)
+
+
+class PollingWatcher(object):
+  def __init__(self, repo):
+    self.repo = repo
+    self.interval = repo.config.getint("poll-interval")
+    self.snapshot = self.scan()
+
+  def scan(self):
+    mtimes = {}
+    for doc in self.repo.walk():
+      try:
+        mtimes[doc.basepath] = doc.mtime()
+      except OSError:
+        pass
+    return mtimes
+
+  def __iter__(self):
+    while True:
+      time.sleep(self.interval)
+      snapshot = self.scan()
+      changed = [p for p in sorted(snapshot)
+                 if self.snapshot.get(p) != snapshot[p]]
+      gone = [self.repo.url(p) for p in sorted(self.snapshot)
+              if p not in snapshot]
+      self.snapshot = snapshot
+
+      if changed or gone:
+        yield ([self.repo.document(p) for p in changed], gone)
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import glob
+import itertools
+import multiprocessing.pool
+import os
+import sqlite3
+
+import db
+
+# A repo with the shard option set is indexed into a file of its own,
+# shards/<repo>.db, rather than into the shared .db, so that crawls of
+# different repos never wait on each other's write lock and each file stays
+# small enough to checkpoint and vacuum.  Searches go to every index at once.
+
+SHARDS = "shards"
+MINID = -2 ** 63
+MAXID = 2 ** 63 - 1
+
+def shard(repo):
+  return os.path.join(SHARDS, "%s.db" % repo)
+
+def indexes(base = ""):
+  # the shared index, if there is one, then every shard
+  names = sorted(glob.glob(os.path.join(base, SHARDS, "*.db")))
+  if os.path.exists(os.path.join(base, ".db")):
+    names.insert(0, os.path.join(base, ".db"))
+  return names
+
+
+# Searches the indexes in parallel, each on a pooled connection of the
+# thread it runs on, and merges their pages of matches by key (see
+# DB.keys()), breaking ties by (index name, id).  Only the merged page is
+# then fetched and snippeted.  bm25 ranks are scored per index, so ranking
+# across shards is approximate; all the indexes must share one full text
+# layout.
+class Federation(object):
+  def __init__(self, base = "", names = None, threads = 8,
+               mmap_size = 256 * 1024 * 1024, cache_size = 16 * 1024 * 1024):
+    self.base = base
+    self.names = names
+    self.mmap_size = mmap_size
+    self.cache_size = cache_size
+    self.pools = {}
+    self.threads = multiprocessing.pool.ThreadPool(threads)
+
+  def indexes(self):
+    names = self.names or indexes(self.base)
+    for name in names:
+      if name not in self.pools:
+        self.pools[name] = db.Pool(name, self.mmap_size, self.cache_size)
+    return names
+
+  def map(self, f, names):
+    # [f(db, name) for each index], in parallel
+    return self.threads.map(lambda name: f(self.pools[name].get(), name),
+                            names)
+
+  def count(self, query):
+    return sum(self.map(lambda _db, name: _db.count(query), self.indexes()))
+
+  def search(self, query, after = None, limit = 10, snippetbytes = 65536):
+    # a page of matches as dicts, as DB.search() but naming the index of
+    # each; after is (key, index, id) of the last match of the page before
+    def keys(_db, name):
+      return (_db.fts, [(key, name, id) for (id, key) in
+                        _db.keys(query, seek(name), limit)])
+
+    def seek(name):
+      # another index's matches with the same key as the last one shown
+      # were all shown if that index comes first in the order of the page,
+      # and none of them otherwise
+      if not after:
+        return None
+      (key, _name, id) = after
+      if name != _name:
+        id = MINID if name > _name else MAXID
+      return (key, id)
+
+    names = self.indexes()
+    pages = self.map(keys, names)
+    if len(set(fts for (fts, page) in pages)) > 1:
+      raise Exception("indexes mix fts4 and fts5 layouts")
+
+    descending = pages and pages[0][0] == "fts4"
+    page = sorted(itertools.chain(*[page for (fts, page) in pages]),
+                  reverse = descending)[:limit]
+
+    def fetch(_db, name):
+      return _db.fetch(query, [(id, key) for (key, _name, id) in page
+                               if _name == name], snippetbytes)
+
+    names = sorted(set(name for (key, name, id) in page))
+    rows = {}
+    for (name, fetched) in zip(names, self.map(fetch, names)):
+      for row in fetched:
+        rows[(name, row["id"])] = dict(row, index = name)
+    return [rows[(name, id)] for (key, name, id) in page if (name, id) in rows]
+
+
+# The PRAGMA data_version of every index, which changes whenever one of them
+# is committed to, or an index comes or goes.  data_version only moves for
+# commits by other connections, so each index's is read from a connection
+# kept open for that alone.
+class Probe(object):
+  def __init__(self, base = ""):
+    self.base = base
+    self.connections = {}
+
+  def version(self):
+    v = []
+    for name in indexes(self.base):
+      if name not in self.connections:
+        self.connections[name] = sqlite3.connect(name,
+                                                 check_same_thread = False)
+      c = self.connections[name]
+      v.append((name, c.execute("PRAGMA data_version").fetchone()[0]))
+    return tuple(v)
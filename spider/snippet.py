@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+import itertools
+import re
+
+# Snippets are made here rather than with the full text SNIPPET() function,
+# which tokenises the whole of every document it is given: callers only pass
+# in the first few tens of kilobytes of the text.  Like SNIPPET(), a snippet
+# is a run of up to tokens words around the query terms, with the terms in
+# bold and an ellipsis wherever text was left out.
+
+WORD = re.compile(r"\w+", re.UNICODE)
+OPERATORS = set(["AND", "OR", "NOT", "NEAR"])
+
+def pattern(query):
+  # a regular expression matching the terms of a full text query: operators
+  # are dropped, and a word followed by * is a prefix
+  if isinstance(query, str):
+    query = query.decode("utf-8", "replace")
+
+  terms = set()
+  for m in re.finditer(r"(\w+)(\*?)", query, re.UNICODE):
+    if m.group(1) in OPERATORS:
+      continue
+    terms.add(re.escape(m.group(1)) + (r"\w*" if m.group(2) else ""))
+  if not terms:
+    return None
+  return re.compile(r"(?<!\w)(?:%s)(?!\w)" % "|".join(sorted(terms)),
+                    re.UNICODE | re.IGNORECASE)
+
+def snippet(text, query, tokens = 15, start = "<b>", end = "</b>",
+            ellipsis = "<b>...</b>", truncated = False):
+  if not text:
+    return ""
+  if isinstance(text, str):
+    text = text.decode("utf-8", "replace")
+
+  # the window starts at the hit with the most others in the next few
+  # hundred characters, or at the start of the text if nothing matched;
+  # only the window itself is split into words
+  p = pattern(query)
+  hits = [m.start() for m in p.finditer(text)] if p else []
+  first = 0
+  if hits:
+    span = tokens * 8
+    (best, j) = (0, 0)
+    for (i, h) in enumerate(hits):
+      while j < len(hits) and hits[j] < h + span:
+        j += 1
+      if j - i > best:
+        (first, best) = (h, j - i)
+
+  window = list(itertools.islice(WORD.finditer(text, first), tokens + 1))
+  if not window:
+    return ""
+
+  out = []
+  if first > 0:
+    out.append(ellipsis)
+  pos = window[0].start()
+  for m in window[:tokens]:
+    out.append(text[pos:m.start()])
+    if p and p.match(m.group()):
+      out += [start, m.group(), end]
+    else:
+      out.append(m.group())
+    pos = m.end()
+  if len(window) > tokens:
+    out.append(ellipsis)
+  elif truncated:
+    out += [text[pos:], ellipsis]
+  else:
+    out.append(text[pos:])
+
+  return "".join(out)
@@ -2,19 +2,28 @@
 
 import argparse
 import importlib
+import itertools
+import json
 import math
 import multiprocessing
 import os
 import requests
 import stat
+import threading
 import time
 import weakref
 
+import cache
 import config
 import db
+import fetcher
 import formats
+import formats.archive
+import metrics
+import shards
 import utils
 import workerpool
+import writer
 
 
 class Document(object):
@@ -24,11 +33,15 @@ class Document(object):
     self.url = url
     self.ancestors = ancestors
     self.children = []
+    self.unchanged = False
+    self.validators = None
+    self.failure = None
 
   def get(self):
     self.report()
     self.download()
-    self.read()
+    if not self.unchanged:
+      self.read()
 
   def report(self):
     if self.url:
@@ -39,46 +52,143 @@ class Document(object):
   def download(self):
     pass
 
-  def fresh(self):
-    assert not self.ancestors
-    c = ctx.db.execute("SELECT mtime FROM documents WHERE url = ?", [self.url])
-    r = c.fetchone()
-    return r and r[0] == self.mtime()
+  def expand(self):
+    return list(self.children)
 
-  def index_one(self):
-    c = ctx.db.execute("INSERT OR REPLACE INTO documents(repo, name, url, mtime, indextime) VALUES (?, ?, ?, ?, STRFTIME('%s', 'now'))",
-                       [self.repo.name, self.name, self.url, self.mtime()])
-    self.id = c.lastrowid
+  def release(self):
+    pass
 
-    if self.ancestors:
-      ctx.db.executemany("INSERT INTO documents_tree VALUES (?, ?, ?)",
-                         [[a().id, self.id, len(self.ancestors) - i] for (i, a) in enumerate(self.ancestors)])
+  def fresh(self, mtimes):
+    assert not self.ancestors
+    return mtimes.get(self.url) == self.mtime()
 
-    if self.text:
-      ctx.db.execute("INSERT INTO documents_fts(rowid, content) VALUES (?, ?)",
-                     [self.id, self.text])
+  def record(self):
+    if self.unchanged:
+      # kept as it is in the index; see writer.index()
+      return (self.repo.name, self.name, self.url, self.mtime(), None, None)
 
-  def touch(self):
-    assert not self.ancestors
-    ctx.db.execute("UPDATE documents SET indextime = STRFTIME('%s', 'now') WHERE documents.rowid IN (SELECT child FROM documents_tree INNER JOIN documents ON documents_tree.parent = documents.rowid WHERE url = ?)", [self.url])
+    return (self.repo.name, self.name, self.url, self.mtime(), self.text,
+            [c.record() for c in self.children])
 
 
 class LocalDocument(Document):
   def __init__(self, repo, name, url, ancestors = []):
     super(LocalDocument, self).__init__(repo, name, url, ancestors)
     self.unlink = False
+    self.hash = None
+    self.entry = None
+    self.members = []
+    self._mtime = None
+    # what may still be extracted from the outermost archive this is in
+    self.budget = None
 
   def mtime(self):
-    return os.stat(self.basepath)[stat.ST_MTIME]
+    if self._mtime is None:
+      self._mtime = os.stat(self.basepath)[stat.ST_MTIME]
+    return self._mtime
+
+  # Documents travel between processes as descriptors, (class, name, url,
+  # basepath, unlink, mtime, hash, validators) followed by anything specific
+  # to the class, and are rebuilt against the receiving worker's own repo.
+  # If unlink is set, basepath is a temporary file which the receiver owns.
+
+  def describe(self, unlink = False):
+    return (self.__class__, self.name, self.url,
+            getattr(self, "basepath", None), unlink, self._mtime, self.hash,
+            self.validators)
+
+  @classmethod
+  def undescribe(cls, repo, desc, depth = 0):
+    (_cls, name, url, basepath, unlink, mtime, hash, validators) = desc[:8]
+    doc = cls.create(repo, desc, [None] * depth)
+    if basepath:
+      doc.basepath = basepath
+      doc.unlink = unlink
+    doc._mtime = mtime
+    doc.hash = hash
+    doc.validators = validators
+    return doc
+
+  @classmethod
+  def create(cls, repo, desc, ancestors):
+    return cls(repo, desc[1], desc[2], ancestors)
 
   def read(self):
-    self.text = formats.read(self.basepath)
+    if ctx.cache and self.entry is None:
+      self.entry = self.lookup()
 
-    for (filename, path) in formats.iter(self.basepath):
+    if self.entry:
+      self.restore()
+      return
+
+    if self.budget is None:
+      self.budget = formats.archive.Budget()
+    try:
+      (self.text, self.members) = formats.extract(self.basepath, self.vet,
+                                                  self.budget)
+    except formats.sandbox.Killed as e:
+      utils.log.warning("%s: %s" % (self.url or self.name, e))
+      self.failure = str(e)
+      (self.text, self.members) = (None, [])
+
+  def vet(self, _type):
+    # files which have killed the sandbox before are not tried again
+    if self.hash is None:
+      self.hash = cache.digest(self.basepath)
+    if writer.failed(ctx.db, self.hash):
+      utils.log.warning("skipping %s: failed in the sandbox before" %
+                        (self.url or self.name))
+      return False
+    return True
+
+  def expand(self):
+    for child in list(self.children):
+      yield child
+
+    # archive members are only extracted as the traversal reaches them
+    for (filename, path) in self.members:
       child = LocalDocument(self.repo, os.path.split(filename)[1], None,
                             self.ancestors + [weakref.ref(self)])
       child.basepath = path
       child.unlink = True
+      child.budget = self.budget
+      if ctx.cache:
+        child.hash = cache.digest(path)
+      self.children.append(child)
+      yield child
+
+    if ctx.cache and self.hash and not self.entry and not self.failure:
+      ctx.cache.put(self.hash, self.text,
+                    [(c.name, c.mtime(), c.hash) for c in self.children])
+
+  def release(self):
+    if self.unlink:
+      self.mtime()  # still wanted by record() once the file has gone
+      os.unlink(self.basepath)
+      self.unlink = False
+
+  def lookup(self):
+    if self.url:
+      hash = ctx.cache.source(self.url, self.mtime())
+      if hash:
+        entry = ctx.cache.get(hash)
+        if entry:
+          self.hash = hash
+          return entry
+
+    if self.hash is None:
+      self.hash = cache.digest(self.basepath)
+    if self.url:
+      ctx.cache.put_source(self.url, self.mtime(), self.hash)
+    return ctx.cache.get(self.hash)
+
+  def restore(self):
+    (self.text, children) = self.entry
+    for (name, mtime, entry) in children:
+      child = LocalDocument(self.repo, name, None,
+                            self.ancestors + [weakref.ref(self)])
+      child._mtime = mtime
+      child.entry = entry
       self.children.append(child)
 
   def __del__(self):
@@ -87,8 +197,27 @@ class LocalDocument(Document):
 
 
 class RemoteDocument(LocalDocument):
+  def __init__(self, repo, name, url, ancestors = []):
+    super(RemoteDocument, self).__init__(repo, name, url, ancestors)
+    self.basepath = None
+
   def download(self):
-    self.basepath = utils.download(self.url)
+    if not self.basepath:
+      try:
+        (self.basepath, self.validators) = \
+            utils.download(self.url, validators = writer.validators(ctx.db, self.url))
+      except utils.NotModified:
+        # unchanged since it was last indexed, and kept as it is in the
+        # index, text and all.  The walked mtime stands, so that the document
+        # compares fresh next time.
+        mtime = writer.mtime(ctx.db, self.url)
+        if mtime is not None:
+          self.unchanged = True
+          if self._mtime is None:
+            self._mtime = mtime
+          return
+        (self.basepath, self.validators) = utils.download(self.url)
+
     self.unlink = True
 
 
@@ -96,6 +225,20 @@ class Repo(workerpool.Worker):
   def __init__(self):
     self.name = Repo.classname_to_name(self.__class__.__name__)
     self.config = config.Config(self.name)
+    # the index this repo's documents go to (see shards.py)
+    if self.config.getboolean("shard"):
+      self.dbname = shards.shard(self.name)
+    else:
+      self.dbname = ".db"
+    # a repo which can list documents newest first may stop its walk at
+    # documents older than since, in which case it clears complete
+    self.since = None
+    self.complete = True
+
+  def watcher(self):
+    # an iterator of ([changed documents], [urls gone]) for a repo which can
+    # watch itself for changes; see Spider.watch()
+    return None
 
   @staticmethod
   def get(name):
@@ -113,49 +256,346 @@ class Repo(workerpool.Worker):
 
 
 class Spider(workerpool.WorkerPool):
-  def __init__(self, repo, processcount = None):
+  def __init__(self, repo, processcount = None, writer = None,
+               rebuild = False, fanout = False, full = False, resume = False):
+    assert writer or not fanout
     super(Spider, self).__init__(processcount, None)
     self.repo = repo
+    self.writer = writer
+    self.rebuild = rebuild
+    self.fanout = fanout
+    self.full = full or rebuild
+    self.resume = resume
+    self.fetcher = None
+    # log progress every statsinterval seconds, if set, and save the
+    # metrics of the crawl to metricsfile
+    self.statsinterval = 0
+    self.metricsfile = None
+    self.stopping = threading.Event()
+    self.liveview = None
 
   def init_worker(self):
-    ctx.db = db.DB(".db")
+    ctx.db = db.DB(self.repo.dbname)
+    ctx.cache = cache.open_cache()
+    ctx.trees = itertools.count()
     self.repo.init_worker()
 
   def deinit_worker(self):
     self.repo.deinit_worker()
+    if ctx.cache:
+      ctx.cache.close()
+    if ctx.db.lockwait:
+      utils.log.info("%.2fs waiting on locks" % ctx.db.lockwait)
     ctx.db.close()
 
   def do_work(self, item):
-    self.index_doc(item)
+    # (descriptor, None) for a top-level document, or (descriptor, (tree,
+    # path, depth, budget)) for a child requeued by fan()
+    (desc, fan) = item
+    try:
+      if fan:
+        self.index_child(desc, *fan)
+      else:
+        self.index_doc(desc[0].undescribe(self.repo, desc))
+    finally:
+      if ctx.cache:
+        ctx.cache.commit()
 
   def index(self):
-    starttime = math.floor(time.time())
+    self.start()
+    try:
+      self.crawl()
+      self.stop()
+    except workerpool.Failed as e:
+      self.abort(e)
+    self.sweep()
+    self.report()
+
+  def watch(self):
+    # crawl once, then keep indexing whatever the repo reports as changed
+    # until interrupted
+    watcher = self.repo.watcher()
+    if not watcher:
+      utils.log.error("the %s repo cannot be watched for changes" %
+                      self.repo.name)
+      raise SystemExit(1)
+
+    self.start()
+    try:
+      self.crawl()
+      self.sync()
+    except workerpool.Failed as e:
+      self.abort(e)
+    self.sweep()
 
+    self.init_worker()
+    try:
+      self.follow(watcher)
+      self.deinit_worker()
+      self.stop()
+    except workerpool.Failed as e:
+      self.abort(e)
+    self.report()
+
+  def follow(self, watcher):
+    try:
+      for (docs, gone) in watcher:
+        if gone:
+          self.write(("delete", gone))
+        for doc in docs:
+          mtimes = dict(ctx.db.execute("SELECT url, mtime FROM documents WHERE url = ?",
+                                       [doc.url]))
+          try:
+            if not doc.fresh(mtimes):
+              self.route(doc)
+          except (IOError, OSError):
+            # gone again before it could be looked at
+            self.write(("delete", [doc.url]))
+    except KeyboardInterrupt:
+      pass
+
+  def start(self):
+    metrics.reset()
+    self.started = time.time()
+    if not os.path.exists(self.repo.dbname):
+      utils.log.error("no index at %s: run db.py%s create" %
+                      (self.repo.dbname,
+                       " --shard %s" % self.repo.name
+                       if self.repo.dbname != ".db" else ""))
+      raise SystemExit(1)
+
+    _db = db.DB(self.repo.dbname)
+    version = _db.version()
+    _db.close()
+    if version < db.latest():
+      utils.log.error("index schema is at version %u, not %u: run db.py migrate" %
+                      (version, db.latest()))
+      raise SystemExit(1)
+
+    _cache = cache.open_cache(True)
+    if _cache:
+      _cache.close()
+
+    if self.writer:
+      self.writer.start_processes()
+    if self.fetcher:
+      self.fetcher.start_processes()
     self.start_processes()
 
-    for doc in self.repo.walk():
-      self.enqueue(doc)
+    if self.statsinterval:
+      self.liveview = threading.Thread(target = self.live)
+      self.liveview.daemon = True
+      self.liveview.start()
 
+  def stop(self):
     self.stop_processes()
+    if self.fetcher:
+      self.fetcher.stop_processes()
+    if self.writer:
+      self.writer.stop_processes()
+    self.stopping.set()
+    if self.liveview:
+      self.liveview.join()
+
+  def abort(self, e):
+    # one of the pools has given up, so the crawl cannot finish: stop the
+    # rest rather than wait on it for ever.  The crawl is left unswept, to
+    # be resumed.
+    utils.log.error("%s: abandoning the crawl" % e)
+    for pool in [self, self.fetcher, self.writer]:
+      if pool:
+        pool.terminate()
+    self.stopping.set()
+    raise SystemExit(1)
+
+  def snapshots(self):
+    # the metrics of every process of the crawl, by process name; those of
+    # the workers are as last reported
+    snapshots = { multiprocessing.current_process().name: metrics.snapshot() }
+    for pool in [self, self.fetcher, self.writer]:
+      if pool:
+        snapshots.update(pool.stats)
+    return snapshots
+
+  def live(self):
+    # documents read so far, the rate since last time, and where the time
+    # is going
+    (last, n) = (time.time(), 0)
+    while not self.stopping.wait(self.statsinterval):
+      total = metrics.merge(self.snapshots().values())
+      now = time.time()
+      busiest = sorted((s[1], stage) for (stage, s) in total.items()
+                       if stage != "idle")[::-1][:4]
+      utils.log.info("%u documents, %.1f/s; %s" %
+                     (metrics.documents(total),
+                      (metrics.documents(total) - n) / (now - last),
+                      ", ".join("%s %.1fs" % (stage, t)
+                                for (t, stage) in busiest)))
+      (last, n) = (now, metrics.documents(total))
+
+  def report(self):
+    # the metrics of the whole crawl, summed over its processes, as a table
+    # in the log, and in full in metricsfile
+    snapshots = self.snapshots()
+    total = metrics.merge(snapshots.values())
+    elapsed = time.time() - self.started
+    utils.log.info("%u documents in %.1fs" % (metrics.documents(total),
+                                              elapsed))
+    for line in metrics.table(total):
+      utils.log.info(line)
+
+    if self.metricsfile:
+      with open(self.metricsfile, "w") as f:
+        json.dump({ "repo": self.repo.name, "start": self.started,
+                    "seconds": elapsed,
+                    "documents": metrics.documents(total),
+                    "stages": metrics.export(total),
+                    "processes": dict((name, metrics.export(snapshot))
+                                      for (name, snapshot)
+                                      in snapshots.items()) },
+                  f, indent = 2, sort_keys = True)
+
+  def sync(self):
+    # wait until everything enqueued so far has been written
+    self.wait()
+    if self.writer:
+      self.writer.enqueue(("flush", ))
+      self.writer.wait()
+
+  def crawl(self):
+    self.starttime = math.floor(time.time())
+    (self.newest, self.swept) = self.load_state()
+    interval = self.repo.config.getint("full-sweep-interval") * 86400
+    if not self.full and self.newest and \
+          self.starttime - self.swept < interval:
+      self.repo.since = self.newest
+
+    # every crawl is journalled until its sweep; a resumed crawl keeps its
+    # original start time, so that the sweep still removes exactly what it
+    # did not see, and skips whatever it already indexed
+    done = set()
+    crawl = self.resume and self.load_crawl()
+    if crawl:
+      (self.starttime, self.repo.since, self.rebuild) = crawl
+      utils.log.info("resuming crawl started %s" % time.ctime(self.starttime))
+      done = self.load_done()
+    else:
+      self.save_crawl()
+
+    if self.rebuild:
+      mtimes = {}
+    else:
+      mtimes = self.load_mtimes()
+    self.fresh = []
+    self.validated = self.fetcher and self.load_validated() or set()
+
+    for doc in metrics.timed_iter("walk", self.repo.walk()):
+      self.newest = max(self.newest, doc.mtime())
+      if doc.url in done:
+        continue
+      if doc.fresh(mtimes):
+        self.fresh.append(doc.url)
+      else:
+        self.route(doc)
+
+  def route(self, doc):
+    # documents fetched before are revalidated by the worker instead, as in
+    # requeue_child()
+    if self.fetcher and isinstance(doc, RemoteDocument) and \
+          doc.url not in self.validated:
+      self.fetcher.fetch((doc.describe(), None))
+    else:
+      self.enqueue((doc.describe(), None))
 
+  def sweep(self):
+    with metrics.timed("sweep"):
+      self.do_sweep()
+
+  def do_sweep(self):
     self.init_worker()
-    ctx.db.execute("DELETE FROM documents WHERE repo = ? AND indextime < ?",
-                   [self.repo.name, starttime])
+    writer.touch(ctx.db, self.fresh)
+    # documents not walked are only known to be gone after a complete walk
+    if self.repo.complete:
+      writer.delete_trees(ctx.db, "repo = ? AND indextime < ?",
+                          [self.repo.name, self.starttime])
+      self.swept = self.starttime
+    ctx.db.execute("INSERT OR REPLACE INTO repos VALUES (?, ?, ?)",
+                   [self.repo.name, self.newest, self.swept])
+    ctx.db.execute("DELETE FROM crawls WHERE repo = ?", [self.repo.name])
     ctx.db.commit()
+    if ctx.cache:
+      ctx.cache.evict(cache.size())
     self.deinit_worker()
 
-  def index_doc(self, doc):
-    if doc.fresh():
-      doc.touch()
-      ctx.db.commit()
-      return
+  def load_state(self):
+    # (newest mtime seen, time of last complete walk) for this repo
+    _db = db.DB(self.repo.dbname)
+    r = _db.execute("SELECT highwater, swept FROM repos WHERE name = ?",
+                    [self.repo.name]).fetchone()
+    _db.close()
+    return r or (0, 0)
+
+  def load_crawl(self):
+    # (start time, since, rebuild) of an unfinished crawl of this repo
+    _db = db.DB(self.repo.dbname)
+    r = _db.execute("SELECT starttime, since, rebuild FROM crawls WHERE repo = ?",
+                    [self.repo.name]).fetchone()
+    _db.close()
+    return r and (r[0], r[1], bool(r[2]))
+
+  def save_crawl(self):
+    _db = db.DB(self.repo.dbname)
+    _db.execute("INSERT OR REPLACE INTO crawls VALUES (?, ?, ?, ?)",
+                [self.repo.name, self.starttime, self.repo.since, self.rebuild])
+    _db.commit()
+    _db.close()
+
+  def load_done(self):
+    # urls of the top-level documents indexed since the crawl started; their
+    # indextime is written in the same transaction as the rest of them
+    _db = db.DB(self.repo.dbname)
+    c = _db.execute("SELECT url FROM documents WHERE repo = ? AND url IS NOT NULL AND indextime >= ? AND rowid NOT IN (SELECT child FROM documents_tree WHERE depth > 0)",
+                    [self.repo.name, self.starttime])
+    done = set(r[0] for r in c)
+    _db.close()
+    return done
+
+  def load_mtimes(self):
+    # url -> mtime of every top-level document previously indexed from this
+    # repo, so unchanged documents never need to reach a worker
+    _db = db.DB(self.repo.dbname)
+    c = _db.execute("SELECT url, mtime FROM documents WHERE repo = ? AND url IS NOT NULL AND rowid NOT IN (SELECT child FROM documents_tree WHERE depth > 0)",
+                    [self.repo.name])
+    mtimes = dict(c)
+    _db.close()
+    return mtimes
+
+  def load_validated(self):
+    # urls of the documents indexed from this repo which have validators
+    _db = db.DB(self.repo.dbname)
+    c = _db.execute("SELECT validators.url FROM validators INNER JOIN documents ON documents.url = validators.url WHERE repo = ?",
+                    [self.repo.name])
+    validated = set(r[0] for r in c)
+    _db.close()
+    return validated
 
+  def index_doc(self, doc):
     try:
       self.do_index(doc)
-      ctx.db.commit()
-
     except utils.DownloadException:
-      ctx.db.rollback()
+      pass
+
+  def write(self, item):
+    if self.writer:
+      self.writer.enqueue(item)
+      return
+
+    try:
+      with metrics.timed("index"):
+        n = writer.apply(ctx.db, item)
+      with metrics.timed("commit"):
+        ctx.db.commit()
+      metrics.add("documents", 0, n)
     except Exception:
       ctx.db.rollback()
       raise
@@ -163,21 +603,141 @@ class Spider(workerpool.WorkerPool):
   def dfs(self, doc, f):
     f(doc)
     failures = []
-    for child in doc.children:
+    for child in doc.expand():
       try:
         self.dfs(child, f)
       except utils.DownloadException:
         failures.append(child)
+      child.release()
     doc.children = [c for c in doc.children if c not in failures]
 
   def do_index(self, doc):
+    if self.fanout:
+      self.fan(doc, (os.getpid(), next(ctx.trees)), ())
+      return
+
     self.dfs(doc, lambda d: d.get())
-    self.dfs(doc, lambda d: d.index_one())
+    self.write(("index", doc.record()))
+    self.save_state(doc)
+
+  def save_state(self, doc, recurse = True):
+    # validators and sandbox failures of doc (and its children)
+    validators = []
+    failures = []
+    def walk(doc):
+      if doc.validators and any(doc.validators):
+        validators.append((doc.url, ) + tuple(doc.validators))
+      if doc.failure:
+        failures.append((doc.hash, doc.failure))
+      if recurse:
+        for c in doc.children:
+          walk(c)
+
+    walk(doc)
+    if validators:
+      self.write(("validators", validators))
+    if failures:
+      self.write(("failures", failures))
+
+  def fan(self, doc, tree, path):
+    # read doc, then requeue its children for any worker to pick up; the
+    # writer puts the tree back together and writes it in one transaction.
+    # Children restored from the cache are cheap and are read inline.
+    inline = []
+    children = []
+    n = 0
+    try:
+      doc.get()
+      for child in doc.expand():
+        if child.entry:
+          self.dfs(child, lambda d: d.get())
+          inline.append(child)
+        else:
+          children.append(child)
+
+      # once doc's own members are out, what is left of its budget is
+      # divided among those requeued, as they no longer share it
+      members = [c for c in children if doc.budget and c.budget is doc.budget]
+      for child in members:
+        child.budget = doc.budget.share(len(members))
+
+      for child in children:
+        self.requeue_child(child, tree, path + (n, ))
+        n += 1
+
+    except utils.DownloadException:
+      self.write(("node", tree, path, n, None))
+      return
+    except Exception:
+      self.write(("abort", tree, path, n))
+      raise
+
+    if doc.unchanged:
+      record = doc.record()
+    else:
+      record = (self.repo.name, doc.name, doc.url, doc.mtime(), doc.text,
+                [c.record() for c in inline])
+    self.write(("node", tree, path, n, record))
+    self.save_state(doc, False)
+
+  def requeue_child(self, child, tree, path):
+    # the child's temporary file, if any, now belongs to whichever worker
+    # picks it up
+    basepath = getattr(child, "basepath", None)
+    if basepath:
+      child.mtime()  # expand() may still want it once the file has gone
+    item = (child.describe(bool(basepath)),
+            (tree, path, len(child.ancestors), child.budget))
+    child.unlink = False
+
+    # documents fetched before are revalidated by the worker instead, which
+    # can reuse the index on a 304
+    if self.fetcher and isinstance(child, RemoteDocument) and not basepath \
+          and not writer.validators(ctx.db, child.url):
+      self.fetcher.fetch(item, True)
+    else:
+      self.requeue(item)
+
+  def prefetch(self, item, fetcher):
+    # called by the fetcher on the way to the queue; the downloaded file
+    # belongs to whichever worker receives the item
+    (desc, fan) = item
+    (path, validators) = fetcher.download(desc[2])
+    return (desc[:3] + (path, True) + desc[5:7] + (validators, ) + desc[8:],
+            fan)
+
+  def index_child(self, desc, tree, path, depth, budget):
+    doc = desc[0].undescribe(self.repo, desc, depth)
+    doc.budget = budget
+    self.fan(doc, tree, path)
+    doc.release()
 
 def parse_args():
   ap = argparse.ArgumentParser()
   ap.add_argument("repo")
   ap.add_argument("-w", "--workers", type = int, default = 4)
+  ap.add_argument("--writer", action = "store_true",
+                  help = "funnel index writes through a single writer process")
+  ap.add_argument("--batch-size", type = int, default = 100)
+  ap.add_argument("--flush-interval", type = float, default = 5.0)
+  ap.add_argument("--fan-out", action = "store_true",
+                  help = "spread archive members and attachments across all workers (implies --writer)")
+  ap.add_argument("-f", "--fetchers", type = int, default = 0,
+                  help = "download remote documents ahead of the workers with this many concurrent requests")
+  ap.add_argument("--rate", type = float, default = 0,
+                  help = "limit fetchers to this many requests per second per host")
+  ap.add_argument("--watch", action = "store_true",
+                  help = "after crawling, keep indexing changes as they happen")
+  ap.add_argument("--full", action = "store_true",
+                  help = "walk the whole repo even if it supports incremental walks")
+  ap.add_argument("--rebuild", action = "store_true",
+                  help = "reindex every document, taking extracted text from the cache where possible")
+  ap.add_argument("--resume", action = "store_true",
+                  help = "continue an interrupted crawl, skipping the documents it already indexed")
+  ap.add_argument("--stats", type = float, default = 0, metavar = "SECONDS",
+                  help = "log progress and the busiest stages this often")
+  ap.add_argument("--metrics", metavar = "FILE",
+                  help = "where to save the crawl's metrics as JSON (default .metrics-<repo>.json)")
   return ap.parse_args()
 
 def main():
@@ -185,7 +745,20 @@ def main():
   multiprocessing.current_process().name = "mm"
   args = parse_args()
   repo = Repo.get(args.repo)
-  Spider(repo, args.workers).index()
+  _writer = None
+  if args.writer or args.fan_out:
+    _writer = writer.Writer(args.batch_size, args.flush_interval,
+                            repo.dbname)
+  s = Spider(repo, args.workers, _writer, args.rebuild, args.fan_out,
+             args.full, args.resume)
+  if args.fetchers:
+    s.fetcher = fetcher.Fetcher(s, args.fetchers, args.rate)
+  s.statsinterval = args.stats
+  s.metricsfile = args.metrics or ".metrics-%s.json" % repo.name
+  if args.watch:
+    s.watch()
+  else:
+    s.index()
 
 ctx = type("Context", (), {})()
 
@@ -6,9 +6,15 @@ import logging
 import os
 import requests
 import tempfile
+import threading
 import time
 import weakref
+# time.strptime() imports this on first use, which is not thread-safe:
+# fetcher threads parsing their first Last-Modified headers at once would
+# fail with AttributeError
+import _strptime
 
+import metrics
 import spider
 
 
@@ -16,8 +22,32 @@ class DownloadException(Exception):
   pass
 
 
-def download(url):
-  response = spider.ctx.s.get(url, stream = True)
+class NotModified(Exception):
+  pass
+
+
+def download(url, s = None, validators = None):
+  # returns (path, (etag, last-modified)); given the validators from an
+  # earlier download, makes a conditional request and raises NotModified on
+  # a 304
+  with metrics.timed("download"):
+    return _download(url, s, validators)
+
+def _download(url, s, validators):
+  if s is None:
+    s = spider.ctx.s
+
+  headers = {}
+  if validators:
+    (etag, modified) = validators
+    if etag:
+      headers["If-None-Match"] = etag
+    if modified:
+      headers["If-Modified-Since"] = modified
+
+  response = s.get(url, stream = True, headers = headers)
+  if response.status_code == 304 and validators:
+    raise NotModified()
   if response.status_code != 200:
     raise DownloadException()
 
@@ -33,6 +63,7 @@ def download(url):
     f.write(data)
   f.flush()
   os.fsync(f.fileno())
+  metrics.add("download", 0, 0, f.tell())
   f.close()
 
   if remaining > 0:
@@ -48,7 +79,30 @@ def download(url):
                         "%a, %d %b %Y %H:%M:%S %Z")
     os.utime(path, (mtime, mtime))
 
-  return path
+  return (path, (response.headers.get("ETag"),
+                 response.headers.get("Last-Modified")))
+
+def background(f, *args):
+  # start f(*args) in a thread; returns a function which waits for and returns
+  # its result, or raises its exception
+  result = []
+  def run():
+    try:
+      result.append((True, f(*args)))
+    except Exception, e:
+      result.append((False, e))
+
+  t = threading.Thread(target = run)
+  t.daemon = True
+  t.start()
+
+  def wait():
+    t.join()
+    (ok, rv) = result[0]
+    if not ok:
+      raise rv
+    return rv
+  return wait
 
 def simple_memo(f):
   cache = weakref.WeakKeyDictionary()
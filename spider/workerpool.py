@@ -1,10 +1,24 @@
 #!/usr/bin/python
 
 import multiprocessing
+import os
+import Queue
+import threading
+import time
 
 from config import config
+import metrics
 import utils
 
+# how often, in seconds, workers send their metrics to the parent
+PUBLISH = 1
+
+
+class Failed(Exception):
+  # a pool has given up: its workers are gone, or one of them met a fatal
+  # error, so nothing should be handed to it or waited on any more
+  pass
+
 
 class Worker(object):
   def init_worker(self):
@@ -15,6 +29,8 @@ class Worker(object):
 
 
 class WorkerPool(Worker):
+  processname = "p"
+
   def __init__(self, processcount = None, maxsize = 0):
     if not processcount or processcount < 1:
       processcount = multiprocessing.cpu_count()
@@ -23,36 +39,118 @@ class WorkerPool(Worker):
       maxsize = 4 * processcount
 
     self.queue = multiprocessing.Queue(maxsize)
+    # work generated by the workers themselves; unbounded so that a worker
+    # can never block on it while the others wait on the main queue
+    self.subqueue = multiprocessing.Queue()
+    self.outstanding = multiprocessing.Value("i", 0)
     self.processcount = processcount
     self.processes = []
+    self.parent = None
+    # set by a worker on its way out after an error, for the benefit of
+    # other processes, which cannot ask after the workers themselves
+    self.failed = multiprocessing.Event()
+    # the latest metrics of each worker, by process name
+    self.reports = multiprocessing.Queue()
+    self.stats = {}
+    self.collector = None
 
   def start_processes(self):
+    self.parent = os.getpid()
     for i in range(self.processcount):
-      p = multiprocessing.Process(target = self.worker, name = "p%u" % (i + 1))
+      p = multiprocessing.Process(target = self.run, name = "%s%u" % (self.processname, i + 1))
       p.start()
       self.processes.append(p)
 
+    # drained all along, so that no worker can block on exit with its last
+    # report unread
+    self.collector = threading.Thread(target = self.collect)
+    self.collector.daemon = True
+    self.collector.start()
+
   def stop_processes(self):
+    self.wait()
+
     for p in self.processes:
       self.queue.put(None)
 
     self.queue.close()
     self.queue.join_thread()
+    self.subqueue.close()
 
     for p in self.processes:
       p.join()
 
     self.processes = []
+    if self.collector:
+      self.reports.put(None)
+      self.collector.join()
+      self.collector = None
+
+  def terminate(self):
+    # stop the workers where they are, e.g. once another pool has failed;
+    # whatever is still queued is lost
+    for p in self.processes:
+      p.terminate()
+      p.join()
+    self.processes = []
+    for q in [self.queue, self.subqueue, self.reports]:
+      q.cancel_join_thread()
+
+  def alive(self):
+    if self.failed.is_set():
+      return False
+    if os.getpid() == self.parent:
+      return any(p.is_alive() for p in self.processes)
+    return True
+
+  def check(self):
+    if not self.alive():
+      raise Failed("%s gave up" % self.__class__.__name__)
+
+  def collect(self):
+    for (name, snapshot) in iter(self.reports.get, None):
+      self.stats[name] = snapshot
+
+  def publish(self, final = False):
+    # send this worker's metrics to the parent, at most every PUBLISH
+    # seconds until the last time
+    now = time.time()
+    if final or now >= self.published + PUBLISH:
+      self.published = now
+      self.reports.put((multiprocessing.current_process().name,
+                        metrics.snapshot()))
+
+  def wait(self):
+    # wait for all work to be done, including any the workers requeue
+    while self.outstanding.value:
+      self.check()
+      time.sleep(0.1)
 
   def do_work(self, item):
     pass
 
+  def run(self):
+    # the target of each worker process
+    try:
+      self.worker()
+    except Failed as e:
+      utils.log.error(str(e))
+      self.failed.set()
+      raise SystemExit(1)
+    except BaseException:
+      self.failed.set()
+      raise
+
   def worker(self):
+    metrics.reset()
+    self.published = time.time()
     self.init_worker()
 
-    for item in iter(self.queue.get, None):
+    for item in iter(self.get, None):
       try:
         self.do_work(item)
+      except Failed:
+        raise
       except Exception:
         utils.log.exception("")
         if config.getboolean("errors-fatal"):
@@ -60,8 +158,50 @@ class WorkerPool(Worker):
       except KeyboardInterrupt:
         utils.log.exception("")
         raise SystemExit
+      finally:
+        self.done()
+        self.publish()
 
     self.deinit_worker()
+    self.publish(True)
+
+  def get(self):
+    # requeued work takes priority, so trees in progress finish first
+    with metrics.timed("idle"):
+      while True:
+        try:
+          return self.subqueue.get_nowait()
+        except Queue.Empty:
+          pass
+
+        try:
+          return self.queue.get(True, 0.1)
+        except Queue.Empty:
+          pass
+
+  def done(self):
+    with self.outstanding.get_lock():
+      self.outstanding.value -= 1
+
+  def count(self):
+    with self.outstanding.get_lock():
+      self.outstanding.value += 1
 
   def enqueue(self, item):
-    self.queue.put(item)
+    self.count()
+    with metrics.timed("queue-wait"):
+      self.put(self.queue, item)
+
+  def put(self, queue, item):
+    # queue.put(), unless the pool gives up while it waits for room
+    while True:
+      self.check()
+      try:
+        queue.put(item, True, 0.1)
+        return
+      except Queue.Full:
+        pass
+
+  def requeue(self, item):
+    self.count()
+    self.subqueue.put(item)
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+import Queue
+import time
+
+from config import config
+import db
+import metrics
+import utils
+import workerpool
+
+# urls per statement in touch()
+TOUCH = 500
+
+
+# A record is the serialisable form of an indexed document tree:
+# (repo, name, url, mtime, text, [child records]).  Children None stands for
+# the tree already indexed at url, which is kept as it is (its server says it
+# has not changed) rather than tokenised all over again.  The ops below which
+# write documents return how many they wrote.
+
+def index(_db, record, ancestors = []):
+  (repo, name, url, mtime, text, children) = record
+  if children is None:
+    return keep(_db, url, mtime, ancestors)
+
+  # whatever was indexed at url before is replaced, subtree and all, but for
+  # any subtrees to be kept, which are cut loose from it first
+  if not ancestors:
+    for _url in kept(record):
+      detach(_db, _url)
+  if url:
+    delete_trees(_db, "url = ?", [url])
+  c = _db.execute("INSERT INTO documents(repo, name, url, mtime, indextime) VALUES (?, ?, ?, ?, STRFTIME('%s', 'now'))",
+                  [repo, name, url, mtime])
+  id = c.lastrowid
+
+  if ancestors:
+    _db.executemany("INSERT INTO documents_tree VALUES (?, ?, ?)",
+                    [[a, id, len(ancestors) - i] for (i, a) in enumerate(ancestors)])
+
+  if text:
+    _db.execute("INSERT INTO %s(docid, content) VALUES (?, ?)" % _db.text,
+                [id, text])
+
+  return 1 + sum(index(_db, child, ancestors + [id]) for child in children)
+
+def kept(record):
+  # the urls of the trees within record to be kept as they are
+  if record[5] is None:
+    return [record[2]]
+  return sum((kept(child) for child in record[5]), [])
+
+def keep(_db, url, mtime, ancestors):
+  # the tree indexed at url, unchanged, is put under ancestors (which may be
+  # new rows) and marked as indexed just now
+  r = _db.execute("SELECT rowid FROM documents WHERE url = ?", [url]).fetchone()
+  if not r:
+    return 0
+
+  detach(_db, url)
+  for (i, a) in enumerate(ancestors):
+    _db.execute("INSERT INTO documents_tree SELECT ?, child, depth + ? FROM documents_tree WHERE parent = ?",
+                [a, len(ancestors) - i, r[0]])
+  _db.execute("UPDATE documents SET mtime = ? WHERE rowid = ?", [mtime, r[0]])
+  return touch(_db, [url])
+
+def detach(_db, url):
+  # cut the tree indexed at url loose from whatever it was indexed under
+  subtree = "SELECT child FROM documents_tree WHERE parent = (SELECT rowid FROM documents WHERE url = ?)"
+  _db.execute("DELETE FROM documents_tree WHERE child IN (%s) AND parent NOT IN (%s)" % (subtree, subtree),
+              [url, url])
+
+def mtime(_db, url):
+  # the mtime indexed for url, if it is indexed
+  r = _db.execute("SELECT mtime FROM documents WHERE url = ?", [url]).fetchone()
+  return r and r[0]
+
+def validators(_db, url):
+  r = _db.execute("SELECT etag, modified FROM validators WHERE url = ?",
+                  [url]).fetchone()
+  return r and tuple(r)
+
+def save_validators(_db, rows):
+  _db.executemany("INSERT OR REPLACE INTO validators VALUES (?, ?, ?)", rows)
+
+def failed(_db, hash):
+  # whether the file with this hash killed the extraction sandbox before
+  r = _db.execute("SELECT 1 FROM failures WHERE hash = ?", [hash]).fetchone()
+  return r is not None
+
+def save_failures(_db, rows):
+  _db.executemany("INSERT OR REPLACE INTO failures VALUES (?, ?, STRFTIME('%s', 'now'))",
+                  rows)
+
+def delete(_db, urls):
+  # a url ending in / stands for everything below it
+  for url in urls:
+    if url.endswith("/"):
+      delete_trees(_db, "url >= ? AND url < ?", [url, url[:-1] + "0"])
+    else:
+      delete_trees(_db, "url = ?", [url])
+
+def delete_trees(_db, where, parameters):
+  # delete the documents matching where, with all their descendants, in a
+  # fixed number of statements however many there are: documents_tree holds
+  # every (ancestor, descendant) pair, so one lookup finds whole subtrees.
+  # The matching documents themselves go last, as the other statements find
+  # the subtrees through them.
+  subtrees = "SELECT child FROM documents_tree WHERE parent IN (SELECT rowid FROM documents WHERE %s)" % where
+  _db.execute("DELETE FROM %s WHERE docid IN (%s)" % (_db.text, subtrees),
+              parameters)
+  _db.execute("DELETE FROM documents WHERE rowid IN (%s AND depth > 0)" % subtrees,
+              parameters)
+  _db.execute("DELETE FROM documents_tree WHERE child IN (%s)" % subtrees,
+              parameters)
+  _db.execute("DELETE FROM documents WHERE %s" % where, parameters)
+
+def touch(_db, urls):
+  # mark the whole subtree of every unchanged top-level document as indexed,
+  # in one statement per TOUCH urls (SQLite allows 999 parameters)
+  n = 0
+  for i in range(0, len(urls), TOUCH):
+    chunk = urls[i:i + TOUCH]
+    c = _db.execute("UPDATE documents SET indextime = STRFTIME('%%s', 'now') WHERE rowid IN (SELECT child FROM documents_tree WHERE parent IN (SELECT rowid FROM documents WHERE url IN (%s)))" % ", ".join("?" * len(chunk)),
+                    chunk)
+    n += c.rowcount
+  return n
+
+ops = { "delete": delete,
+        "failures": save_failures,
+        "index": index,
+        "validators": save_validators }
+
+def apply(_db, item):
+  # the number of documents written
+  return ops[item[0]](_db, *item[1:]) or 0
+
+
+# A document tree whose nodes were read by different workers.  Each worker
+# sends ("node", tree, path, n, record) once it has read the node at path
+# (a tuple of child indices) and requeued its n children; record holds any
+# children read inline, and is None if the node was dropped.  ("abort", tree,
+# path, n) discards the whole tree.  Nodes may arrive in any order.
+class Tree(object):
+  def __init__(self):
+    self.nodes = {}
+    self.expected = 1
+    self.orphans = 0
+    self.aborted = False
+
+  def add(self, path, n, record):
+    self.nodes[path] = (n, record)
+    self.expected += n
+    if path and path[:-1] not in self.nodes:
+      self.orphans += 1
+    self.orphans -= len([i for i in range(n) if path + (i, ) in self.nodes])
+
+  def complete(self):
+    return not self.orphans and len(self.nodes) == self.expected
+
+  def record(self, path = ()):
+    (n, record) = self.nodes[path]
+    if record is None or record[5] is None:
+      return record
+
+    children = [self.record(path + (i, )) for i in range(n)]
+    return record[:5] + (record[5] + [c for c in children if c], )
+
+
+# Single process owning all index writes.  Workers enqueue ("index", record)
+# items; these are applied in transactions of up to
+# batchsize items, or whatever has arrived within flushinterval seconds.
+class Writer(workerpool.WorkerPool):
+  processname = "w"
+
+  def __init__(self, batchsize = 100, flushinterval = 5.0, name = ".db"):
+    super(Writer, self).__init__(1, 2 * batchsize)
+    self.batchsize = batchsize
+    self.flushinterval = flushinterval
+    self.name = name
+
+  def init_worker(self):
+    self.db = db.DB(self.name)
+    self.trees = {}
+    self.pending = []
+    self.deadline = None
+    self.items = 0
+    self.transactions = 0
+
+  def deinit_worker(self):
+    if self.trees:
+      utils.log.warning("writer: discarding %u incomplete trees" %
+                        len(self.trees))
+    utils.log.info("writer: %u items in %u transactions, %.2fs waiting on locks" %
+                   (self.items, self.transactions, self.db.lockwait))
+    self.db.close()
+
+  def do_work(self, item):
+    if item[0] == "flush":
+      self.flush()
+      return
+
+    if item[0] in ["node", "abort"]:
+      item = self.assemble(item)
+      if not item:
+        return
+
+    if not self.pending:
+      self.deadline = time.time() + self.flushinterval
+    self.pending.append(item)
+
+    if len(self.pending) >= self.batchsize:
+      self.flush()
+
+  def assemble(self, item):
+    (op, tree, path, n) = item[:4]
+    t = self.trees.setdefault(tree, Tree())
+    if op == "abort":
+      t.aborted = True
+      t.add(path, n, None)
+    else:
+      t.add(path, n, item[4])
+
+    if not t.complete():
+      return None
+
+    del self.trees[tree]
+    record = t.record()
+    if t.aborted or not record:
+      return None
+    return ("index", record)
+
+  def flush(self):
+    # apply everything pending in one transaction; an item which fails is
+    # logged and dropped and the remainder retried.  If it is the commit
+    # which fails, there is no telling which item was at fault, and the
+    # whole batch is dropped.
+    while self.pending:
+      (n, i) = (0, None)
+      try:
+        for (i, item) in enumerate(self.pending):
+          with metrics.timed("index"):
+            n += apply(self.db, item)
+        i = None
+        with metrics.timed("commit"):
+          self.db.commit()
+      except Exception:
+        self.db.rollback()
+        utils.log.exception("")
+        if config.getboolean("errors-fatal"):
+          raise SystemExit
+        if i is None:
+          utils.log.error("writer: dropping %u items" % len(self.pending))
+          self.pending = []
+        else:
+          del self.pending[i]
+        continue
+
+      metrics.add("documents", 0, n)
+      self.items += len(self.pending)
+      self.transactions += 1
+      self.pending = []
+
+  def timeout(self):
+    if not self.pending:
+      return None
+    return max(0, self.deadline - time.time())
+
+  def worker(self):
+    metrics.reset()
+    self.published = time.time()
+    self.init_worker()
+
+    try:
+      while True:
+        try:
+          with metrics.timed("idle"):
+            item = self.queue.get(True, self.timeout())
+        except Queue.Empty:
+          self.flush()
+          self.publish()
+          continue
+
+        if item is None:
+          break
+
+        try:
+          self.do_work(item)
+        except Exception:
+          utils.log.exception("")
+          if config.getboolean("errors-fatal"):
+            raise SystemExit
+        finally:
+          self.done()
+          self.publish()
+
+      self.flush()
+
+    except KeyboardInterrupt:
+      utils.log.exception("")
+      raise SystemExit
+
+    self.deinit_worker()
+    self.publish(True)